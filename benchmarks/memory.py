@@ -0,0 +1,73 @@
+'''
+Measure the memory used by parsed qsyasm programs: the bytes per instruction
+still allocated after parsing a generated program of single and two qubit
+gates.
+
+Usage: python benchmarks/memory.py [-n INSTRUCTIONS] [--qubits QUBITS]
+'''
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from qsyasm.interpreter.parser import QsyASMParser  # noqa: E402
+
+SINGLE_QUBIT_GATES = ('h', 'x', 'y', 'z', 's', 't')
+
+
+def generate(instructions, qubits):
+    random.seed(0)
+
+    lines = ['qreg[{}] q'.format(qubits), 'creg[{}] c'.format(qubits)]
+
+    for i in range(instructions):
+        if i % 3 == 0:
+            control, target = random.sample(range(qubits), 2)
+            lines.append('cx q[{}], q[{}]'.format(control, target))
+        elif i % 3 == 1:
+            lines.append('rz(pi/{}) q[{}]'.format(random.randint(1, 64), random.randrange(qubits)))
+        else:
+            lines.append('{} q[{}]'.format(random.choice(SINGLE_QUBIT_GATES),
+                                           random.randrange(qubits)))
+
+    lines.append('meas q, c')
+    return '\n'.join(lines) + '\n'
+
+
+def measure(function, *args):
+    '''
+    Return the result of a call and the bytes it allocated that are still in
+    use after it returns.
+    '''
+    tracemalloc.start()
+    result = function(*args)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, allocated
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='qsyasm program memory benchmark')
+    argparser.add_argument('-n', '--instructions', type=int, default=100000,
+                           help='amount of gates in the generated program (default: 100000)')
+    argparser.add_argument('--qubits', type=int, default=16,
+                           help='size of the register of the generated program (default: 16)')
+    args = argparser.parse_args()
+
+    source = generate(args.instructions, args.qubits)
+    parser = QsyASMParser()
+
+    instructions, parsed = measure(parser.parse, source)
+
+    print('parsed {} instructions: {:.1f} MiB, {:.0f} bytes per instruction'.format(
+        len(instructions), parsed / 2**20, parsed / len(instructions)
+    ))
+
+
+if __name__ == '__main__':
+    main()
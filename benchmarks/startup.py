@@ -0,0 +1,69 @@
+'''
+Measure qsyasm startup: the time from starting a process until the first
+instruction of a program is executed. Every run starts a fresh interpreter
+that runs the qsyasm command-line interface, which is stopped as soon as the
+program starts executing.
+
+Usage: python benchmarks/startup.py [-n RUNS] [filename]
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Report the time at which the first instruction executes on stderr and stop
+CHILD = '''
+import os
+import sys
+import time
+
+from qsyasm.cli import main
+from qsyasm.program import QsyASMProgram
+
+
+def first_instruction(self, steps):
+    print(time.time(), file=sys.stderr)
+    sys.stderr.flush()
+    os._exit(0)
+
+
+QsyASMProgram._execute = first_instruction
+
+sys.argv = ['qsyasm'] + sys.argv[1:]
+main()
+'''
+
+
+def measure(filename):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    start = time.time()
+    result = subprocess.run([sys.executable, '-c', CHILD, filename], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+
+    return float(result.stderr.split()[-1]) - start
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='qsyasm startup benchmark')
+    argparser.add_argument('filename', nargs='?',
+                           default=os.path.join(ROOT, 'examples', 'qsyasm', 'bell.qs'),
+                           help='qsyasm file to start (default: examples/qsyasm/bell.qs)')
+    argparser.add_argument('-n', '--runs', type=int, default=20,
+                           help='amount of processes to start (default: 20)')
+    args = argparser.parse_args()
+
+    timings = [measure(args.filename) for _ in range(args.runs)]
+
+    print('startup to first instruction over {} runs: min {:.1f} ms, median {:.1f} ms'.format(
+        args.runs, 1000*min(timings), 1000*statistics.median(timings)
+    ))
+
+
+if __name__ == '__main__':
+    main()
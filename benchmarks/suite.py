@@ -0,0 +1,235 @@
+'''
+Benchmark suite of the qsy back-ends and the qsyasm pipeline: gate
+throughput of the statevector back-end by qubit count, measurement cost,
+CHP gate and measurement scaling, parse time by program size and complete
+runs of the example programs.
+
+Every benchmark is run with a fixed seed and reports the best time of a few
+repeats, which is the least sensitive to other load on the machine. Results
+are written as JSON, and compared against a baseline from an earlier run so
+changes show up per benchmark. benchmarks/baseline.json is a reference run.
+Timings are only comparable to a baseline recorded on the same machine.
+
+Usage: python benchmarks/suite.py [-k PATTERN] [-o RESULTS] [--baseline BASELINE]
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+import qsy  # noqa: E402
+from qsy import gates  # noqa: E402
+from qsy.backends import CHPBackend, StatevectorBackend  # noqa: E402
+from qsyasm.interpreter.parser import QsyASMParser  # noqa: E402
+from qsyasm.program import QsyASMProgram  # noqa: E402
+
+from memory import generate  # noqa: E402
+
+STATEVECTOR_QUBITS = (4, 8, 12, 16, 20)
+CHP_QUBITS = (100, 500, 1000, 2000)
+PROGRAM_SIZES = (1000, 10000, 50000)
+EXAMPLES = os.path.join(ROOT, 'examples', 'qsyasm')
+
+REPEAT = 5
+SEED = 1
+
+
+def timed(function, repeat=REPEAT, number=1):
+    '''
+    Return the best time of repeat runs of number calls, per call.
+    '''
+    best = float('inf')
+
+    for _ in range(repeat):
+        np.random.seed(SEED)
+
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter() - start)
+
+    return best / number
+
+
+def calls(size):
+    '''
+    Amount of calls per repeat, so small registers are timed over more than
+    a few microseconds.
+    '''
+    return max(1, 2**16 >> size)
+
+
+def statevector_benchmarks():
+    for size in STATEVECTOR_QUBITS:
+        backend = StatevectorBackend(size, 'q')
+
+        for target in range(size):
+            backend.apply_gate(gates.H, target)
+
+        number = calls(size)
+        middle = size // 2
+
+        yield 'statevector/h/{}'.format(size), lambda: \
+            timed(lambda: backend.apply_gate(gates.H, middle), number=number)
+        yield 'statevector/rx/{}'.format(size), lambda: \
+            timed(lambda: backend.apply_gate(gates.Rx(0.5), middle), number=number)
+        yield 'statevector/cx/{}'.format(size), lambda: \
+            timed(lambda: backend.apply_gate(gates.CX, 0, size - 1), number=number)
+        yield 'statevector/ccx/{}'.format(size), lambda: \
+            timed(lambda: backend.apply_gate(gates.CCX, 0, middle, size - 1), number=number)
+
+        # Measuring costs a pass over the state whatever the amplitudes are,
+        # so measuring a collapsed state is as expensive
+        yield 'statevector/measure/{}'.format(size), lambda: \
+            timed(lambda: backend.measure(middle), number=number)
+        yield 'statevector/measure_all/{}'.format(size), lambda: \
+            timed(backend.measure_all, number=number)
+
+
+def chp_benchmarks():
+    for size in CHP_QUBITS:
+        backend = CHPBackend(size, 'q')
+
+        def ghz():
+            backend.apply_gate(gates.H, 0)
+            for target in range(1, size):
+                backend.apply_gate(gates.CX, target - 1, target)
+
+        def measure():
+            ghz()
+            for target in range(size):
+                backend.measure(target)
+
+        yield 'chp/h/{}'.format(size), lambda: \
+            timed(lambda: backend.apply_gate(gates.H, size // 2), number=100)
+        yield 'chp/s/{}'.format(size), lambda: \
+            timed(lambda: backend.apply_gate(gates.S, size // 2), number=100)
+        yield 'chp/cx/{}'.format(size), lambda: \
+            timed(lambda: backend.apply_gate(gates.CX, 0, size - 1), number=100)
+
+        # The first measurement of a GHZ state is random and all others are
+        # deterministic, per measured qubit
+        yield 'chp/measure/{}'.format(size), lambda: timed(measure, repeat=3) / size
+
+
+def parse_benchmarks():
+    parser = QsyASMParser()
+
+    for size in PROGRAM_SIZES:
+        source = generate(size, 16)
+        yield 'parse/{}'.format(size), lambda: timed(lambda: parser.parse(source), repeat=3)
+
+
+def example_benchmarks():
+    for filename in sorted(os.listdir(EXAMPLES)):
+        args = {'filename': os.path.join(EXAMPLES, filename), 'seed': SEED}
+
+        def run():
+            output = io.StringIO()
+
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                QsyASMProgram(args).run()
+
+        yield 'qsyasm/{}'.format(os.path.splitext(filename)[0]), lambda: timed(run, repeat=3)
+
+
+# Every suite yields the name of each benchmark and a function that runs it
+SUITES = (statevector_benchmarks, chp_benchmarks, parse_benchmarks, example_benchmarks)
+
+
+def run(pattern):
+    results = {}
+
+    for suite in SUITES:
+        for name, benchmark in suite():
+            if pattern in name:
+                results[name] = seconds = benchmark()
+                print('{:<32} {:>12.3f} us'.format(name, 1e6 * seconds))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Print the change of every benchmark relative to the baseline, and return
+    the names of benchmarks that got slower by more than threshold.
+    '''
+    regressions = []
+
+    print()
+    print('{:<32} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'change'))
+
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+
+        change = seconds / baseline[name] - 1
+        marker = ''
+
+        if change > threshold:
+            regressions.append(name)
+            marker = ' slower'
+
+        print('{:<32} {:>9.3f} us {:>9.3f} us {:>+7.1%}{}'.format(
+            name, 1e6 * baseline[name], 1e6 * seconds, change, marker
+        ))
+
+    return regressions
+
+
+def environment():
+    return {
+        'qsy': qsy.__version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count()
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='qsy benchmark suite')
+    argparser.add_argument('-k', dest='pattern', default='',
+                           help='only run benchmarks whose name contains PATTERN')
+    argparser.add_argument('-o', '--output', default=None, metavar='RESULTS',
+                           help='write the results as JSON to RESULTS')
+    argparser.add_argument('--baseline', default=None,
+                           help='compare the results against a JSON file written with -o')
+    argparser.add_argument('--threshold', type=float, default=0.1,
+                           help='relative slowdown reported as a regression (default: 0.1)')
+    args = argparser.parse_args()
+
+    results = run(args.pattern)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline.get('environment') != environment():
+            print('\nThe baseline was recorded in a different environment: {}'.format(
+                json.dumps(baseline.get('environment'))))
+
+        regressions = compare(results, baseline['results'], args.threshold)
+
+        if regressions:
+            print('\n{} of {} benchmarks slower than the baseline'.format(
+                len(regressions), len(results)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,22 @@
-from .statevector import StatevectorBackend
-from .chp import CHPBackend
+import importlib
+
+# Back-ends are imported when first used, so only the ones a program selects
+# are loaded
+_BACKEND_MODULES = {
+    'StatevectorBackend': '.statevector',
+    'CHPBackend': '.chp',
+    'SparseBackend': '.sparse',
+    'MemmapBackend': '.memmap'
+}
+
+__all__ = list(_BACKEND_MODULES)
+
+
+def __getattr__(name):
+    if name not in _BACKEND_MODULES:
+        raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+    backend = getattr(importlib.import_module(_BACKEND_MODULES[name], __name__), name)
+    globals()[name] = backend
+
+    return backend
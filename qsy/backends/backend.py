@@ -1,9 +1,15 @@
 import abc
+import itertools
+
+import numpy as np
 
 from qsy.error import RegisterIndexError
 
 
 class Backend(abc.ABC):
+    # Amount of amplitudes yielded at a time by yield_chunks
+    CHUNK_SIZE = 2**14
+
     @abc.abstractmethod
     def apply_gate(self, gate, *params, adjoint=False):
         raise NotImplementedError()
@@ -16,6 +22,14 @@ class Backend(abc.ABC):
     def measure(self, target):
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def sample(self, shots, qubits=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def expectation(self, pauli):
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def yield_state(self):
         raise NotImplementedError()
@@ -24,6 +38,40 @@ class Backend(abc.ABC):
     def to_dirac(self):
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def reset(self):
+        '''
+        Reset the state to |0...0> in place, keeping its allocations.
+        '''
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def snapshot(self):
+        '''
+        Return a copy of the state that restore can return to.
+        '''
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def restore(self, snapshot):
+        raise NotImplementedError()
+
+    def yield_chunks(self, chunk_size=CHUNK_SIZE):
+        '''
+        Yield the state as arrays of at most chunk_size basis state indices
+        and their amplitudes.
+        '''
+        states = self.yield_state()
+
+        while True:
+            chunk = list(itertools.islice(states, chunk_size))
+
+            if not chunk:
+                return
+
+            indices, amplitudes = zip(*chunk)
+            yield np.array(indices), np.array(amplitudes)
+
     def _check_in_range(self, target):
         if target < 0 or target >= self.size:
             raise RegisterIndexError(
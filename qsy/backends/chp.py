@@ -1,3 +1,5 @@
+import copy
+
 import numpy as np
 
 from qsy import gates
@@ -5,6 +7,8 @@ from qsyasm.log import print_info
 
 from .backend import Backend
 
+ALL_ONES = np.uint64(2**64 - 1)
+
 
 class CHPBackend(Backend):
     '''
@@ -12,36 +16,36 @@ class CHPBackend(Backend):
     of only CNOT, H and phase gates). The algorithm used to achieve this is
     described in a paper by Scott Aaronson and Daniel Gottesman found at
     https://arxiv.org/abs/quant-ph/0406196.
+
+    The tableau is stored bit-packed: for every qubit j, x[j] and z[j] are
+    arrays of uint64 words in which bit i is the X or Z component of generator
+    i on qubit j. Gates touch only the columns of the qubits they act on, so
+    they cost O(n/64) word operations.
     '''
 
     SUPPORTED_GATES = [gates.CX, gates.H, gates.S, gates.X, gates.Y, gates.Z,
                        gates.CZ]
 
+    WORD_SIZE = 64
+
     def __init__(self, size, name):
         self.name = name
         self.size = size
 
-        # Initialize tableau
-        # X generators
-        self.x = np.concatenate(
-            (np.eye(self.size, dtype=np.int8),
-             np.zeros((self.size, self.size), dtype=np.int8),
-             # scratch space
-             np.zeros((1, self.size), dtype=np.int8)),
-            axis=0
-        )
+        # Rows 0..n-1 are the destabilizers, rows n..2n-1 the stabilizers
+        self.rows = 2*self.size
+        self.words = -(-self.rows // self.WORD_SIZE)
 
+        # X generators
+        self.x = np.zeros((self.size, self.words), dtype=np.uint64)
         # Z generators
-        self.z = np.concatenate(
-            (np.zeros((self.size, self.size), dtype=np.int8),
-             np.eye(self.size, dtype=np.int8),
-             # scratch space
-             np.zeros((1, self.size), dtype=np.int8)),
-            axis=0
-        )
+        self.z = np.zeros((self.size, self.words), dtype=np.uint64)
+        # Phase bits (0 for +1, 1 for -1)
+        self.r = np.zeros(self.words, dtype=np.uint64)
 
-        # Phase (0 for +1, 1 for i, 2 for -1, 3 for -i)
-        self.r = np.zeros((2*self.size + 1, 1), dtype=np.int8)
+        self.reset()
+
+        self.stabilizer_mask = self._pack(np.arange(self.rows) >= self.size)
 
     def apply_gate(self, gate, *params, adjoint=False):
         if gate not in self.SUPPORTED_GATES:
@@ -81,47 +85,134 @@ class CHPBackend(Backend):
             self._cz(control, target)
 
     def measure(self, target):
-        p = None
-        for i in range(self.size, 2*self.size):
-            if self.x[i, target] == 1:
-                p = i
-                break
+        self._check_in_range(target)
 
-        if p is not None:
+        anticommuting = self.x[target]
+        stabilizers = anticommuting & self.stabilizer_mask
+
+        if stabilizers.any():
             # Measurement outcome is probabilistic
-            for i in range(2*self.size):
-                if i != p and self.x[i, target] == 1:
-                    self._rowsum(i, p)
+            p = self._first_bit(stabilizers)
+
+            rows = anticommuting.copy()
+            self._assign_row(rows, p, False)
+
+            # Multiply row p into every other row anticommuting with Z_target.
+            # The phase of each product is 2r_h + 2r_p + sum(g) (mod 4), where
+            # sum(g) = #plus - #minus is even, so only bit 1 of both counts is
+            # needed.
+            x_p = self._row_bits(self.x, p)
+            z_p = self._row_bits(self.z, p)
+            r_p = self._row_bits(self.r, p)
+
+            # Only qubits on which row p is not the identity contribute
+            support = np.flatnonzero(x_p | z_p)
+            x = self.x[support]
+            z = self.z[support]
+            x_p_words = self._broadcast_bits(x_p[support])[:, None]
+            z_p_words = self._broadcast_bits(z_p[support])[:, None]
+
+            plus, minus = self._phase_masks(x_p_words, z_p_words, x, z)
+            phase = (self._count_bit1(plus) ^ self._count_bit1(minus) ^
+                     self.r ^ self._broadcast_bits(r_p))
+
+            self.r = (self.r & ~rows) | (phase & rows)
+            self.x[support] = x ^ (x_p_words & rows)
+            self.z[support] = z ^ (z_p_words & rows)
 
             # Set (p−n)th row equal to pth row
-            self.x[p-self.size] = self.x[p]
-            self.z[p-self.size] = self.z[p]
-            self.r[p-self.size] = self.r[p]
+            self._assign_row(self.x, p - self.size, x_p)
+            self._assign_row(self.z, p - self.size, z_p)
+            self._assign_row(self.r, p - self.size, r_p)
 
-            self.x[p] = 0
-            self.z[p] = 0
+            self._assign_row(self.x, p, False)
+            self._assign_row(self.z, p, False)
 
             measurement = np.random.randint(2)
-            self.r[p] = measurement
+            self._assign_row(self.r, p, measurement)
 
-            self.z[p, target] = 1
+            self._assign_row(self.z[target], p, True)
 
             return measurement
         else:
             # Measurement outcome is deterministic
-            self.x[2*self.size] = 0
-            self.z[2*self.size] = 0
-            self.r[2*self.size] = 0
-
-            for i in range(self.size):
-                if self.x[i, target] == 1:
-                    self._rowsum(2*self.size, i + self.size)
-
-            return int(self.r[2*self.size])
+            return int(self._stabilizer_product_phase(anticommuting) == 2)
 
     def measure_all(self):
         return [self.measure(i) for i in range(self.size)]
 
+    def reset(self):
+        '''
+        Reset the tableau to that of |0...0>: destabilizer i is X_i and
+        stabilizer i is Z_i, all with phase +1.
+        '''
+        self.x[:] = 0
+        self.z[:] = 0
+        self.r[:] = 0
+
+        qubits = np.arange(self.size)
+        self._set_bits(self.x, qubits, qubits)
+        self._set_bits(self.z, qubits, qubits + self.size)
+
+    def snapshot(self):
+        return self.x.copy(), self.z.copy(), self.r.copy()
+
+    def restore(self, snapshot):
+        x, z, r = snapshot
+        np.copyto(self.x, x)
+        np.copyto(self.z, z)
+        np.copyto(self.r, r)
+
+    def sample(self, shots, qubits=None):
+        '''
+        Sample measurement outcomes without collapsing the state, by measuring
+        a copy of the tableau every shot. Outcomes are integers over the given
+        qubits (all qubits by default), the first being the most significant
+        bit. They are Python integers, as registers can be far larger than 64
+        qubits.
+        '''
+        if qubits is None:
+            qubits = range(self.size)
+
+        for qubit in qubits:
+            self._check_in_range(qubit)
+
+        samples = np.empty(shots, dtype=object)
+
+        # Every shot measures the same copy, restored to this tableau first
+        state = self.snapshot()
+        shot = copy.copy(self)
+        shot.x, shot.z, shot.r = self.snapshot()
+
+        for i in range(shots):
+            shot.restore(state)
+
+            outcome = 0
+            for qubit in qubits:
+                outcome = (outcome << 1) | int(shot.measure(qubit))
+
+            samples[i] = outcome
+
+        return samples
+
+    def expectation(self, pauli):
+        '''
+        Return the expectation value of a Pauli string. It is 0 unless the
+        string commutes with all stabilizers, in which case it is +1 or -1 as
+        it is (up to sign) a product of stabilizers.
+        '''
+        x_qubits = [q for q, p in enumerate(pauli) if p in 'XY']
+        z_qubits = [q for q, p in enumerate(pauli) if p in 'YZ']
+
+        # Generator rows that anticommute with the Pauli string
+        anticommuting = (np.bitwise_xor.reduce(self.z[x_qubits], axis=0) ^
+                         np.bitwise_xor.reduce(self.x[z_qubits], axis=0))
+
+        if (anticommuting & self.stabilizer_mask).any():
+            return 0.0
+
+        return 1.0 - self._stabilizer_product_phase(anticommuting)
+
     def yield_state(self):
         print_info(
             'Printing quantum state is not supported by the CHP back-end. ' +
@@ -134,71 +225,150 @@ class CHPBackend(Backend):
         return ''
 
     def _h(self, target):
-        for i in range(2*self.size):
-            self.r[i] ^= self.x[i, target] & self.z[i, target]
-            self.x[i, target], self.z[i, target] = self.z[i, target], self.x[i, target]
+        self.r ^= self.x[target] & self.z[target]
+        self.x[target], self.z[target] = self.z[target], self.x[target].copy()
 
     def _cnot(self, control, target):
-        for i in range(2*self.size):
-            self.r[i] ^= self.x[i, control] & self.z[i, target]
-            self.r[i] &= self.x[i, target] ^ self.z[i, control] ^ 1
+        self.r ^= (self.x[control] & self.z[target] &
+                   ~(self.x[target] ^ self.z[control]))
 
-            self.x[i, target] ^= self.x[i, control]
-            self.z[i, control] ^= self.z[i, target]
+        self.x[target] ^= self.x[control]
+        self.z[control] ^= self.z[target]
 
     def _s(self, target):
-        for i in range(2*self.size):
-            self.r[i] ^= self.x[i, target] & self.z[i, target]
-            self.z[i, target] ^= self.x[i, target]
+        self.r ^= self.x[target] & self.z[target]
+        self.z[target] ^= self.x[target]
 
     def _x(self, target):
-        self._h(target)
-        self._z(target)
-        self._h(target)
+        self.r ^= self.z[target]
 
     def _y(self, target):
-        self._z(target)
-        self._h(target)
-        self._z(target)
-        self._h(target)
+        self.r ^= self.x[target] ^ self.z[target]
 
     def _z(self, target):
-        self._s(target)
-        self._s(target)
+        self.r ^= self.x[target]
 
     def _cz(self, control, target):
         self._h(target)
         self._cnot(control, target)
         self._h(target)
 
-    def _rowsum(self, h, i):
-        '''
-        Set generator h equal to h + i. Keep track of the factors of i that r_h
-        goes through when multiplying Pauli matrices.
-        '''
-        def g(x1, z1, x2, z2):
-            '''
-            Return the exponent to which i is raised (either 0, 1, or −1) when
-            the Pauli matrices represented by x1 z1 and x2 z2 are multiplied.
-            '''
-            if x1 == z1 == 0:
-                return 0
-            if x1 == z1 == 1:
-                return z2 - x2
-            if x1 == 1 and z1 == 0:
-                return z2 * (2*x2 - 1)
-            if x1 == 0 and z1 == 1:
-                return x2 * (1 - 2*z2)
-
-        rowsum = sum(g(self.x[i, j], self.z[i, j], self.x[h, j], self.z[h, j])
-                     for j in range(self.size))
-        rowsum += 2*self.r[h] + 2*self.r[i]
-
-        if rowsum == 0:
-            self.r[h] = 0
-        elif rowsum == 2 % 4:
-            self.r[h] = 1
-
-        for j in range(self.size):
-            self.x[h, j] ^= self.x[i, j]
-            self.z[h, j] ^= self.z[i, j]
+    def _stabilizer_product_phase(self, anticommuting):
+        '''
+        Return the phase (0 for +1, 2 for -1) of the product of the stabilizers
+        n+i for every destabilizer i in anticommuting. For a Pauli string that
+        commutes with all stabilizers this product is that string up to sign.
+        '''
+        destabilizers = self._unpack(anticommuting)[:self.size]
+        rows = self._pack(np.concatenate((np.zeros(self.size, dtype=bool),
+                                          destabilizers)))
+
+        row_x = self.x & rows
+        row_z = self.z & rows
+
+        # Only qubits on which some of these rows are not the identity
+        # contribute
+        support = np.flatnonzero((row_x | row_z).any(axis=1))
+        row_x = row_x[support]
+        row_z = row_z[support]
+
+        # Every row is multiplied onto the product of all rows before it
+        product_x = self._prefix_parity(row_x) ^ row_x
+        product_z = self._prefix_parity(row_z) ^ row_z
+
+        plus, minus = self._phase_masks(row_x, row_z, product_x, product_z)
+
+        phase = (_popcount(plus) - _popcount(minus) +
+                 2*_popcount(self.r & rows))
+
+        return phase % 4
+
+    @staticmethod
+    def _phase_masks(x1, z1, x2, z2):
+        '''
+        Return word masks of where the exponent to which i is raised is +1 and
+        where it is −1 when the Pauli matrices represented by x1 z1 and x2 z2
+        are multiplied.
+        '''
+        plus = ((x1 & z1 & z2 & ~x2) |
+                (x1 & ~z1 & z2 & x2) |
+                (~x1 & z1 & x2 & ~z2))
+        minus = ((x1 & z1 & x2 & ~z2) |
+                 (x1 & ~z1 & z2 & ~x2) |
+                 (~x1 & z1 & x2 & z2))
+
+        return plus, minus
+
+    @staticmethod
+    def _count_bit1(words):
+        '''
+        Return bit 1 of the number of set bits per generator row over all
+        qubits (axis 0), i.e. the parity of the number of pairs of set bits.
+        '''
+        preceding = np.bitwise_xor.accumulate(words, axis=0) ^ words
+        return np.bitwise_xor.reduce(words & preceding, axis=0)
+
+    def _prefix_parity(self, words):
+        '''
+        Return the inclusive prefix XOR of the generator bits of each column.
+        '''
+        prefix = words.copy()
+        for shift in (1, 2, 4, 8, 16, 32):
+            prefix ^= prefix << np.uint64(shift)
+
+        # Carry the parity of all preceding words into every word
+        parity = prefix >> np.uint64(self.WORD_SIZE - 1)
+        carry = np.bitwise_xor.accumulate(parity, axis=-1) ^ parity
+
+        return prefix ^ self._broadcast_bits(carry)
+
+    def _unpack(self, packed):
+        '''
+        Unpack bit-packed generator words to booleans, one per generator row.
+        '''
+        bits = np.unpackbits(packed.astype('<u8').view(np.uint8),
+                             axis=-1, bitorder='little')
+        return bits[..., :self.rows].view(bool)
+
+    def _pack(self, bits):
+        '''Pack booleans (one per generator row) into uint64 words.'''
+        padded = np.zeros(self.words*self.WORD_SIZE, dtype=bool)
+        padded[:self.rows] = bits
+        return np.packbits(padded, bitorder='little').view('<u8').astype(np.uint64)
+
+    def _row_bits(self, packed, row):
+        '''Return the bits of a generator row from bit-packed words.'''
+        word, bit = divmod(row, self.WORD_SIZE)
+        return ((packed[..., word] >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+
+    def _assign_row(self, packed, row, bits):
+        '''Set the bits of a generator row in bit-packed words.'''
+        word, bit = divmod(row, self.WORD_SIZE)
+        mask = np.uint64(1) << np.uint64(bit)
+
+        packed[..., word] &= ~mask
+        packed[..., word] |= np.where(bits, mask, np.uint64(0))
+
+    def _set_bits(self, packed, columns, rows):
+        '''Set one generator row bit in each of the given columns.'''
+        words, bits = np.divmod(rows, self.WORD_SIZE)
+        packed[columns, words] |= np.left_shift(np.uint64(1), bits.astype(np.uint64))
+
+    def _first_bit(self, packed):
+        '''Return the index of the lowest set bit in bit-packed words.'''
+        word = np.flatnonzero(packed)[0]
+        value = int(packed[word])
+        return word*self.WORD_SIZE + (value & -value).bit_length() - 1
+
+    @staticmethod
+    def _broadcast_bits(bits):
+        '''Turn booleans into all-ones or all-zeros words.'''
+        return np.where(bits, ALL_ONES, np.uint64(0))
+
+
+def _popcount(words):
+    '''Return the total number of set bits in an array of uint64 words.'''
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum())
+
+    return int(np.unpackbits(np.ascontiguousarray(words).view(np.uint8)).sum())
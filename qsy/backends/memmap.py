@@ -0,0 +1,250 @@
+import itertools
+import os
+import tempfile
+
+import numpy as np
+
+from qsy.error import InvalidRegisterError
+
+from .statevector import StatevectorBackend, _complex_dtype, _pauli_sum, _pauli_value
+
+
+class MemmapBackend(StatevectorBackend):
+    '''
+    MemmapBackend is a statevector back-end that keeps the state in a
+    memory-mapped file instead of in memory, for registers whose state doesn't
+    fit in RAM. Gates, measurements and state output walk through the file in
+    contiguous chunks of 2^chunk_qubits amplitudes, so every operation streams
+    through the file once and only a few chunks are resident at a time.
+
+    When path is given the state is stored in that file, and an existing file
+    is picked up as the initial state instead of |0...0>. It must have been
+    written with the same register size and precision. Without a path the
+    state lives in an anonymous temporary file.
+    '''
+
+    # 2^20 amplitudes per chunk, 16 MiB at complex128
+    CHUNK_QUBITS = 20
+
+    def __init__(self, size, name, precision='complex128', path=None,
+                 chunk_qubits=CHUNK_QUBITS):
+        self.name = name
+        self.size = size
+        self.dtype = _complex_dtype(precision)
+        self.state_size = 2**size
+        self.chunk_qubits = min(chunk_qubits, size)
+        self.chunk_size = 2**self.chunk_qubits
+        self.path = path
+
+        # The state is walked chunk by chunk on the calling thread, never
+        # split over threads like StatevectorBackend does
+        self.threads = 1
+        self._executor = None
+
+        shape = (self.state_size,)
+
+        if path is None:
+            # Anonymous file, removed as soon as it's closed
+            self._file = tempfile.TemporaryFile()
+            self.state = np.memmap(self._file, dtype=self.dtype, mode='w+', shape=shape)
+            self.state[0] = 1  # Initialize to zero state
+        elif os.path.exists(path):
+            expected_size = self.state_size * self.dtype.itemsize
+            actual_size = os.path.getsize(path)
+
+            if actual_size != expected_size:
+                raise InvalidRegisterError(
+                    'State file {} doesn\'t match register {} ({} bytes, expected {})'.format(
+                        path, name, actual_size, expected_size
+                    )
+                )
+
+            self.state = np.memmap(path, dtype=self.dtype, mode='r+', shape=shape)
+        else:
+            self.state = np.memmap(path, dtype=self.dtype, mode='w+', shape=shape)
+            self.state[0] = 1  # Initialize to zero state
+
+    def measure_all(self):
+        measured = int(self.sample(1)[0])
+
+        for _, chunk in self._chunks():
+            chunk[:] = 0
+        self.state[measured] = 1
+
+        binary_measurement = format(measured, '0{}b'.format(self.size))
+        return [int(x) for x in binary_measurement]
+
+    def sample(self, shots, qubits=None):
+        '''
+        Sample measurement outcomes without collapsing the state. Outcomes are
+        integers over the given qubits, the first being the most significant
+        bit, or basis state indices when no qubits are given. The probability
+        of every chunk is computed in one pass, after which only chunks that
+        were drawn are read again.
+        '''
+        weights = np.array([np.vdot(chunk, chunk).real for _, chunk in self._chunks()])
+        cumulative = np.cumsum(weights)
+
+        draws = np.sort(np.random.random(shots) * cumulative[-1])
+        chunk_indices = np.minimum(np.searchsorted(cumulative, draws, side='right'),
+                                   len(weights) - 1)
+
+        samples = []
+        for k in np.unique(chunk_indices):
+            start = k * self.chunk_size
+            chunk = self.state[start:start + self.chunk_size]
+            probabilities = np.cumsum(np.abs(chunk).astype(np.float64)**2)
+
+            offsets = draws[chunk_indices == k] - (cumulative[k] - weights[k])
+            indices = np.searchsorted(probabilities, offsets, side='right')
+            samples.append(start + np.minimum(indices, len(chunk) - 1))
+
+        samples = np.concatenate(samples)
+        np.random.shuffle(samples)
+
+        if qubits is not None:
+            # Marginalising would need a pass over the whole state per chunk of
+            # outcomes, projecting the sampled indices is cheaper
+            samples = self._project(samples, qubits)
+
+        return samples
+
+    def measure(self, target):
+        self._check_in_range(target)
+
+        probability = 0.0
+        for start, chunk in self._chunks():
+            _, one_amplitudes = self._split_chunk(start, chunk, target)
+            probability += float(np.sum(one_amplitudes * one_amplitudes))
+
+        probability = min(max(probability, 0.0), 1.0)
+
+        measured_value = int(np.random.random() < probability)
+
+        if measured_value == 1:
+            norm = np.sqrt(probability)
+        else:
+            norm = np.sqrt(1.0 - probability)
+
+        for start, chunk in self._chunks():
+            halves = self._split_chunk(start, chunk, target)
+            halves[1 - measured_value][...] = 0
+            halves[measured_value][...] /= norm
+
+        return measured_value
+
+    def expectation(self, pauli):
+        '''
+        Return the expectation value of a Pauli string, one chunk at a time.
+        Each chunk is paired with the chunk its leading qubits are flipped to,
+        and the sign of its leading qubits is the same for the whole chunk.
+        '''
+        high = self.size - self.chunk_qubits
+        flips = int(''.join('1' if p in 'XY' else '0' for p in pauli[:high]) or '0', 2)
+        phases = int(''.join('1' if p in 'YZ' else '0' for p in pauli[:high]) or '0', 2)
+
+        shape = (2,) * self.chunk_qubits
+        total = 0
+
+        for start, chunk in self._chunks():
+            k = start >> self.chunk_qubits
+            partner_start = (k ^ flips) << self.chunk_qubits
+            partner = self.state[partner_start:partner_start + self.chunk_size]
+
+            chunk_sum = _pauli_sum(partner.reshape(shape), chunk.reshape(shape),
+                                   pauli[high:])
+
+            if bin(k & phases).count('1') % 2:
+                total -= chunk_sum
+            else:
+                total += chunk_sum
+
+        return _pauli_value(total, pauli)
+
+    def yield_state(self):
+        for start, chunk in self._chunks():
+            for i, amplitude in enumerate(np.array(chunk)):
+                yield start + i, amplitude
+
+    def flush(self):
+        '''Write pending changes of the state to its file.'''
+        self.state.flush()
+
+    def reset(self):
+        for start, chunk in self._chunks():
+            chunk[:] = 0
+
+        self.state[0] = 1
+
+    def snapshot(self):
+        '''
+        Copy the state chunk by chunk to an anonymous temporary file, as it
+        may not fit in memory.
+        '''
+        snapshot = np.memmap(tempfile.TemporaryFile(), dtype=self.dtype, mode='w+',
+                             shape=(self.state_size,))
+
+        for start, chunk in self._chunks():
+            snapshot[start:start + len(chunk)] = chunk
+
+        return snapshot
+
+    def restore(self, snapshot):
+        for start, chunk in self._chunks():
+            chunk[:] = snapshot[start:start + len(chunk)]
+
+    def _apply_matrix(self, matrix, targets, controls=()):
+        '''
+        Apply a 2^k x 2^k matrix to the k qubits in targets, one block of
+        chunks at a time. Qubits whose stride is at least a chunk select which
+        chunks are combined: targets among them span the block, controls fix
+        them to 1 and all other qubits are iterated over in file order. The
+        remaining qubits are axes within each chunk.
+        '''
+        high = self.size - self.chunk_qubits
+
+        tensor = self.state.reshape((2,) * self.size)
+
+        high_targets = sorted(target for target in targets if target < high)
+        free = [qubit for qubit in range(high)
+                if qubit not in targets and qubit not in controls]
+
+        # Axis of every qubit within a block
+        axes = {target: i for i, target in enumerate(high_targets)}
+        for qubit in range(high, self.size):
+            axes[qubit] = len(high_targets) + qubit - high
+
+        block_targets = [axes[target] for target in targets]
+        block_controls = [axes[control] for control in controls if control >= high]
+
+        index = [slice(None)] * self.size
+        for control in controls:
+            if control < high:
+                index[control] = 1
+
+        for values in itertools.product((0, 1), repeat=len(free)):
+            for qubit, value in zip(free, values):
+                index[qubit] = value
+
+            block = tensor[tuple(index)]
+            self._apply_matrix_to(block, matrix, block_targets, block_controls)
+
+    def _chunks(self):
+        for start in range(0, self.state_size, self.chunk_size):
+            yield start, self.state[start:start + self.chunk_size]
+
+    def _split_chunk(self, start, chunk, target):
+        '''
+        Return real-valued views on the amplitudes of a chunk where the target
+        qubit is 0 and 1 respectively.
+        '''
+        amplitudes = chunk.view(chunk.real.dtype)
+        stride = 2**(self.size - 1 - target)
+
+        if stride >= len(chunk):
+            # The target qubit is the same for the whole chunk
+            empty = amplitudes[:0]
+            return (empty, amplitudes) if start & stride else (amplitudes, empty)
+
+        amplitudes = amplitudes.reshape(-1, 2, 2*stride)
+        return amplitudes[:, 0, :], amplitudes[:, 1, :]
@@ -0,0 +1,225 @@
+import numpy as np
+
+from qsy.error import InvalidRegisterError
+from qsy.util import format_dirac_terms
+
+from .backend import Backend
+from .statevector import _complex_dtype, _pauli_value
+
+
+class SparseBackend(Backend):
+    '''
+    SparseBackend only stores the nonzero amplitudes of the state, as sorted
+    arrays of basis state indices and amplitudes. Gates are applied to the
+    populated basis states only and amplitudes that become (near) zero are
+    pruned, so memory scales with the number of nonzero amplitudes instead of
+    2^n. This makes it suitable for states like GHZ states or mostly classical
+    computations on many qubits. Amplitudes are stored with the given complex
+    precision, either complex64 or complex128.
+    '''
+
+    # Basis state indices are stored as 64-bit integers
+    MAX_QUBITS = 63
+
+    # Amplitudes with an absolute value below this are dropped
+    PRUNE_TOLERANCE = 1e-12
+
+    def __init__(self, size, name, precision='complex128'):
+        if size > self.MAX_QUBITS:
+            raise InvalidRegisterError(
+                'Register {} too large for the sparse back-end ({} qubits, maximum {})'.format(
+                    name, size, self.MAX_QUBITS
+                )
+            )
+
+        self.name = name
+        self.size = size
+        self.dtype = _complex_dtype(precision)
+
+        self.reset()
+
+    def apply_gate(self, gate, *params, adjoint=False):
+        for param in params:
+            self._check_in_range(param)
+
+        operation = gate.adjoint_matrix if adjoint else gate.matrix
+        operation = np.asarray(operation, dtype=self.dtype)
+
+        if len(operation) == 2**gate.arity:
+            # Unitary acting on all of its qubits, like fused gates
+            self._apply_matrix(operation, params)
+        else:
+            *controls, target = params
+            self._apply_matrix(operation, [target], controls)
+
+    def measure_all(self):
+        probabilities = self._probabilities()
+
+        measured = np.random.choice(self.indices, p=probabilities)
+        self.indices = np.array([measured], dtype=np.int64)
+        self.amplitudes = np.ones(1, dtype=self.dtype)
+
+        binary_measurement = format(measured, '0{}b'.format(self.size))
+        return [int(x) for x in binary_measurement]
+
+    def measure(self, target):
+        self._check_in_range(target)
+
+        ones = (self.indices >> self._shift(target)) & 1 == 1
+        probability = np.sum(np.abs(self.amplitudes[ones])**2)
+        probability = min(max(float(probability), 0.0), 1.0)
+
+        measured_value = int(np.random.random() < probability)
+
+        if measured_value == 1:
+            keep, norm = ones, np.sqrt(probability)
+        else:
+            keep, norm = ~ones, np.sqrt(1.0 - probability)
+
+        self.indices = self.indices[keep]
+        self.amplitudes = self.amplitudes[keep] / norm
+
+        return measured_value
+
+    def sample(self, shots, qubits=None):
+        '''
+        Sample measurement outcomes without collapsing the state. Outcomes are
+        integers over the given qubits, the first being the most significant
+        bit, or basis state indices when no qubits are given.
+        '''
+        if qubits is None:
+            return np.random.choice(self.indices, size=shots, p=self._probabilities())
+
+        for qubit in qubits:
+            self._check_in_range(qubit)
+
+        # Marginalise by summing the probabilities of populated basis states
+        # that agree on qubits
+        outcomes = np.zeros_like(self.indices)
+        for qubit in qubits:
+            outcomes = (outcomes << 1) | ((self.indices >> self._shift(qubit)) & 1)
+
+        outcomes, inverse = np.unique(outcomes, return_inverse=True)
+        probabilities = np.bincount(inverse.ravel(), weights=self._probabilities())
+
+        return np.random.choice(outcomes, size=shots, p=probabilities)
+
+    def expectation(self, pauli):
+        '''
+        Return the expectation value of a Pauli string, pairing every
+        populated basis state with the state its X and Y qubits flip it to.
+        '''
+        flips = 0
+        parity = np.zeros_like(self.indices)
+
+        for qubit, p in enumerate(pauli):
+            if p in 'XY':
+                flips |= 1 << self._shift(qubit)
+            if p in 'YZ':
+                parity ^= (self.indices >> self._shift(qubit)) & 1
+
+        partners = self.indices ^ flips
+        positions = np.minimum(np.searchsorted(self.indices, partners),
+                               len(self.indices) - 1)
+        found = self.indices[positions] == partners
+
+        total = np.sum(np.conj(self.amplitudes[positions[found]]) *
+                       self.amplitudes[found] * (1 - 2*parity[found]))
+
+        return _pauli_value(total, pauli)
+
+    def yield_state(self):
+        # Only populated basis states are yielded, a sparse state can be far
+        # too large to enumerate
+        for i, amplitude in zip(self.indices, self.amplitudes):
+            yield int(i), amplitude
+
+    def yield_chunks(self, chunk_size=Backend.CHUNK_SIZE):
+        for start in range(0, len(self.indices), chunk_size):
+            yield (self.indices[start:start + chunk_size],
+                   self.amplitudes[start:start + chunk_size])
+
+    def to_dirac(self):
+        return ' '.join(term for indices, amplitudes in self.yield_chunks()
+                        for term in format_dirac_terms(indices, amplitudes, self.size))
+
+    def reset(self):
+        self.indices = np.zeros(1, dtype=np.int64)
+        self.amplitudes = np.ones(1, dtype=self.dtype)
+
+    def snapshot(self):
+        return self.indices.copy(), self.amplitudes.copy()
+
+    def restore(self, snapshot):
+        # Operations replace the arrays instead of changing them, so the
+        # snapshot can be shared until the next restore
+        self.indices, self.amplitudes = snapshot
+
+    def _apply_matrix(self, matrix, targets, controls=()):
+        '''
+        Apply a 2^k x 2^k matrix to the k qubits in targets for the populated
+        basis states where all controls are 1.
+        '''
+        control_mask = 0
+        for control in controls:
+            control_mask |= 1 << self._shift(control)
+
+        active = (self.indices & control_mask) == control_mask
+        indices = self.indices[active]
+        amplitudes = self.amplitudes[active]
+
+        # Index of every basis state within the matrix, and its index with all
+        # target bits cleared
+        k = len(targets)
+        columns = np.zeros(len(indices), dtype=np.int64)
+        base = indices.copy()
+
+        for target in targets:
+            bits = (indices >> self._shift(target)) & 1
+            columns = (columns << 1) | bits
+            base &= ~(1 << self._shift(target))
+
+        if np.count_nonzero(matrix - np.diag(np.diagonal(matrix))) == 0:
+            # Diagonal gates only scale amplitudes
+            new_indices = indices
+            new_amplitudes = np.diagonal(matrix)[columns] * amplitudes
+        else:
+            # Every basis state contributes to all 2^k states on its targets
+            new_indices = []
+            new_amplitudes = []
+
+            for row in range(2**k):
+                row_index = base.copy()
+
+                for i, target in enumerate(targets):
+                    if (row >> (k - 1 - i)) & 1:
+                        row_index |= 1 << self._shift(target)
+
+                new_indices.append(row_index)
+                new_amplitudes.append(matrix[row][columns] * amplitudes)
+
+            new_indices = np.concatenate(new_indices)
+            new_amplitudes = np.concatenate(new_amplitudes)
+
+        indices = np.concatenate((self.indices[~active], new_indices))
+        amplitudes = np.concatenate((self.amplitudes[~active], new_amplitudes))
+
+        # Sum contributions to the same basis state
+        self.indices, inverse = np.unique(indices, return_inverse=True)
+        self.amplitudes = np.zeros(len(self.indices), dtype=self.dtype)
+        np.add.at(self.amplitudes, inverse.ravel(), amplitudes)
+
+        self._prune()
+
+    def _prune(self):
+        keep = np.abs(self.amplitudes) > self.PRUNE_TOLERANCE
+        self.indices = self.indices[keep]
+        self.amplitudes = self.amplitudes[keep]
+
+    def _probabilities(self):
+        probabilities = np.abs(self.amplitudes).astype(np.float64)**2
+        return probabilities / probabilities.sum()
+
+    def _shift(self, qubit):
+        # Qubit 0 is the most significant bit of a basis state index
+        return self.size - 1 - qubit
@@ -1,11 +1,9 @@
-import functools
 import itertools
+import math
 
 import numpy as np
-import numpy.linalg as la
 
-from qsy import gates
-from qsy.util import format_complex
+from qsy.util import format_dirac_terms
 
 from .backend import Backend
 
@@ -13,27 +11,68 @@ from .backend import Backend
 class StatevectorBackend(Backend):
     '''
     StatevectorBackend uses a vector to describe the state of the system.
-    To evolve the system, vector matrix multiplication is used. It can simulate
-    all supported clifford and non-clifford gates.
+    To evolve the system, gates are contracted against the target axes of the
+    state viewed as a rank-n tensor. It can simulate all supported clifford and
+    non-clifford gates. The state is stored with the given complex precision,
+    either complex64 or complex128.
+
+    An existing buffer of 2^n amplitudes can be passed as state to avoid
+    allocating a new one, it is reset to the zero state.
+
+    With more than one thread, gates and measurements on large states split
+    the amplitudes into independent blocks that are processed on a thread
+    pool. NumPy releases the GIL in its inner loops, so blocks run in parallel.
     '''
 
-    def __init__(self, size, name):
+    # States smaller than this are always processed on the calling thread
+    PARALLEL_THRESHOLD = 2**16
+    # Amplitudes updated at a time by a gate, which bounds the scratch memory
+    # it needs
+    BLOCK_SIZE = 2**13
+
+    def __init__(self, size, name, precision='complex128', threads=1, state=None):
         self.name = name
         self.size = size
+        self.dtype = _complex_dtype(precision)
         self.state_size = 2**size
-        self.state = np.zeros(self.state_size)
+
+        if state is None:
+            self.state = np.zeros(self.state_size, dtype=self.dtype)
+        else:
+            # Reuse a preallocated buffer
+            if state.shape != (self.state_size,) or state.dtype != self.dtype:
+                raise ValueError(
+                    'State buffer of shape {} and type {} doesn\'t fit register {}'.format(
+                        state.shape, state.dtype, name
+                    )
+                )
+
+            self.state = state
+            self.state[:] = 0
+
         self.state[0] = 1  # Initialize to zero state
 
+        self.threads = threads
+        self._executor = None
+        if threads > 1 and self.state_size >= self.PARALLEL_THRESHOLD:
+            # Only imported when needed, it's slow to import
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(threads)
+
     def apply_gate(self, gate, *params, adjoint=False):
         if gate.arity == 1:
             target = params[0]
             self._apply_single_qubit_gate(gate, target, adjoint)
+        elif len(gate.matrix) == 2**gate.arity:
+            # Unitary acting on all of its qubits, like fused gates
+            self._apply_multi_qubit_gate(gate, params, adjoint)
         else:
             *controls, target = params
             self._apply_controlled_gate(gate, controls, target, adjoint)
 
     def measure_all(self):
-        probabilities = np.abs(self.state)**2
+        probabilities = np.abs(self.state).astype(np.float64)**2
+        probabilities /= probabilities.sum()
 
         measured = np.random.choice(len(probabilities), p=probabilities)
         self.state[:] = 0
@@ -42,56 +81,82 @@ class StatevectorBackend(Backend):
         binary_measurement = format(measured, '0{}b'.format(self.size))
         return [int(x) for x in binary_measurement]
 
+    def sample(self, shots, qubits=None):
+        '''
+        Sample measurement outcomes without collapsing the state. Outcomes are
+        integers over the given qubits, the first being the most significant
+        bit, or basis state indices when no qubits are given.
+        '''
+        probabilities = np.abs(self.state).astype(np.float64)**2
+        probabilities /= probabilities.sum()
+
+        if qubits is not None:
+            probabilities = self._marginalize(probabilities, qubits)
+
+        return np.random.choice(len(probabilities), size=shots, p=probabilities)
+
     def measure(self, target):
-        step_size = self.state_size // 2**(target+1)
-        n_steps = (self.state.size // step_size) // 2
+        self._check_in_range(target)
 
-        # Create masks to extract amplitudes where target qubit is zero and one.
-        zeros_mask = np.tile(
-            np.concatenate((np.ones(step_size), np.zeros(step_size))), n_steps
-        )
-        ones_mask = np.tile(
-            np.concatenate((np.zeros(step_size), np.ones(step_size))), n_steps
-        )
+        amplitudes = self._real_qubit_view(target)
 
-        zero_amplitudes = self.state * zeros_mask
-        one_amplitudes = self.state * ones_mask
-        probabilities = np.abs(zero_amplitudes + one_amplitudes)**2
+        # Probability of measuring 1, computed without temporaries
+        probability = sum(self._map(lambda one: float(np.einsum('ij,ij->', one, one)),
+                                    self._split(amplitudes[:, 1, :])))
+        probability = min(max(probability, 0.0), 1.0)
 
-        measured = np.random.choice(len(probabilities), p=probabilities)
-        measured_value = 1 if one_amplitudes[measured] != 0.0 else 0
+        measured_value = int(np.random.random() < probability)
 
+        # Collapse the state onto the measured outcome and renormalize in place
         if measured_value == 1:
-            for i in zero_amplitudes.nonzero():
-                self.state[i] = 0
+            norm = np.sqrt(probability)
         else:
-            for i in one_amplitudes.nonzero():
-                self.state[i] = 0
+            norm = np.sqrt(1.0 - probability)
+
+        def collapse(block):
+            block[:, 1 - measured_value, :] = 0
+            block[:, measured_value, :] /= norm
 
-        self._normalize()
+        self._map(collapse, self._split(amplitudes))
 
         return measured_value
 
+    def expectation(self, pauli):
+        '''
+        Return the expectation value of a Pauli string, one of I, X, Y or Z
+        per qubit, without building its matrix.
+        '''
+        tensor = self.state.reshape((2,) * self.size)
+        return _pauli_value(_pauli_sum(tensor, tensor, pauli), pauli)
+
     def yield_state(self):
         for i, amplitude in np.ndenumerate(self.state):
             yield i[0], amplitude
 
+    def yield_chunks(self, chunk_size=Backend.CHUNK_SIZE):
+        for start in range(0, self.state_size, chunk_size):
+            amplitudes = self.state[start:start + chunk_size]
+            yield np.arange(start, start + len(amplitudes)), amplitudes
+
     def to_dirac(self):
-        return ' '.join('{}|{:0{n:d}b}>'.format(format_complex(a), i, n=self.size)
-                        for a, i in zip(self.state, itertools.count())
-                        if not np.isclose(a, 0.0))
+        return ' '.join(term for indices, amplitudes in self.yield_chunks()
+                        for term in format_dirac_terms(indices, amplitudes, self.size))
 
-    def _apply_single_qubit_gate(self, gate, target, adjoint):
-        self._check_in_range(target)
+    def reset(self):
+        self.state[:] = 0
+        self.state[0] = 1
 
-        operation = gate.adjoint_matrix if adjoint else gate.matrix
+    def snapshot(self):
+        return self.state.copy()
 
-        transformation = [gates.I.matrix] * self.size
-        transformation[target] = operation
+    def restore(self, snapshot):
+        np.copyto(self.state, snapshot)
 
-        transformation_matrix = functools.reduce(np.kron, transformation)
+    def _apply_single_qubit_gate(self, gate, target, adjoint):
+        self._check_in_range(target)
 
-        self._transform(transformation_matrix)
+        operation = gate.adjoint_matrix if adjoint else gate.matrix
+        self._apply_matrix(operation, [target])
 
     def _apply_controlled_gate(self, gate, controls, target, adjoint):
         self._check_in_range(target)
@@ -100,31 +165,264 @@ class StatevectorBackend(Backend):
             self._check_in_range(control)
 
         operation = gate.adjoint_matrix if adjoint else gate.matrix
-        control_matrix = np.array([[float('nan'), 0],
-                                   [0, 1]])
-        transformation = []
-
-        for i in range(self.size):
-            if i in controls:
-                transformation.append(control_matrix)
-            elif i == target:
-                transformation.append(operation)
-            else:
-                transformation.append(gates.I.matrix)
-
-        transformation_matrix = functools.reduce(np.kron, transformation)
-
-        for (i, j), value in np.ndenumerate(transformation_matrix):
-            if np.isnan(value):
-                if i == j:
-                    transformation_matrix[i, j] = 1
-                else:
-                    transformation_matrix[i, j] = 0
-
-        self._transform(transformation_matrix)
-
-    def _transform(self, operation):
-        self.state = np.dot(self.state, operation)
-
-    def _normalize(self):
-        self.state = self.state / la.norm(self.state)
+        self._apply_matrix(operation, [target], controls)
+
+    def _apply_multi_qubit_gate(self, gate, targets, adjoint):
+        for target in targets:
+            self._check_in_range(target)
+
+        operation = gate.adjoint_matrix if adjoint else gate.matrix
+        self._apply_matrix(operation, list(targets))
+
+    def _apply_matrix(self, matrix, targets, controls=()):
+        '''
+        Apply a 2^k x 2^k matrix to the k qubits in targets, in place. The
+        state is viewed as a rank-n tensor (axis i being qubit i) so only the
+        target axes are touched, restricted to the subspace where all controls
+        are 1. This costs O(2^n) per gate instead of building a 2^n x 2^n
+        operator.
+        '''
+        tensor = self.state.reshape((2,) * self.size)
+        split = self._split_qubits(targets, controls)
+
+        if not split:
+            self._apply_matrix_to(tensor, matrix, targets, controls)
+            return
+
+        # Every combination of values of the split qubits selects an
+        # independent block, in which the remaining qubits keep their order
+        axes = {qubit: qubit - sum(s < qubit for s in split)
+                for qubit in range(self.size) if qubit not in split}
+        block_targets = [axes[target] for target in targets]
+        block_controls = [axes[control] for control in controls]
+
+        def apply(values):
+            index = [slice(None)] * self.size
+            for qubit, value in zip(split, values):
+                index[qubit] = value
+
+            self._apply_matrix_to(tensor[tuple(index)], matrix, block_targets,
+                                  block_controls)
+
+        self._map(apply, itertools.product((0, 1), repeat=len(split)))
+
+    def _apply_matrix_to(self, tensor, matrix, targets, controls=()):
+        '''
+        Apply a 2^k x 2^k matrix in place to the target axes of a rank-m
+        tensor of amplitudes, where all control axes are 1. The tensor is
+        updated in blocks of at most BLOCK_SIZE amplitudes, so the memory a
+        gate needs besides the state is bounded by the block size.
+        '''
+        # Index with length-1 slices rather than integers so every selection
+        # stays a view on the state, even when all axes are fixed.
+        index = [slice(None)] * tensor.ndim
+        for control in controls:
+            index[control] = slice(1, 2)
+
+        if len(targets) == 1:
+            target, = targets
+            index[target] = slice(0, 1)
+            zero = tensor[tuple(index)]
+            index[target] = slice(1, 2)
+            one = tensor[tuple(index)]
+
+            self._apply_single_qubit_matrix(matrix, zero, one)
+            return
+
+        k = len(targets)
+        operation = np.reshape(np.asarray(matrix, dtype=self.dtype), (2,) * 2*k)
+
+        # Move the target axes last, so every block holds all amplitudes the
+        # matrix mixes
+        subspace = np.moveaxis(tensor[tuple(index)], targets, range(-k, 0))
+        target_axes = list(range(-k, 0))
+        input_axes = list(range(k, 2*k))
+
+        for block in _blocks(subspace, self.BLOCK_SIZE, free=subspace.ndim - k):
+            block[...] = np.tensordot(block, operation, axes=(target_axes, input_axes))
+
+    def _apply_single_qubit_matrix(self, matrix, zero, one):
+        '''
+        Apply a 2x2 matrix to the amplitude views where the target qubit is 0
+        and 1 respectively.
+        '''
+        (a, b), (c, d) = np.asarray(matrix, dtype=self.dtype)
+
+        if b == 0 and c == 0:
+            # Diagonal gates only scale amplitudes
+            if a != 1:
+                zero *= a
+            if d != 1:
+                one *= d
+            return
+
+        if zero.size <= self.BLOCK_SIZE:
+            self._update_block(a, b, c, d, zero, one, np.empty_like(zero),
+                               np.empty_like(zero))
+            return
+
+        # Scratch space for the old zero amplitudes and a product, reused
+        # for every block
+        old_zero = np.empty(self.BLOCK_SIZE, dtype=self.dtype)
+        product = np.empty(self.BLOCK_SIZE, dtype=self.dtype)
+
+        for zero_block, one_block in zip(_blocks(zero, self.BLOCK_SIZE),
+                                         _blocks(one, self.BLOCK_SIZE)):
+            size = zero_block.size
+            self._update_block(a, b, c, d, zero_block, one_block,
+                               old_zero[:size].reshape(zero_block.shape),
+                               product[:size].reshape(zero_block.shape))
+
+    def _update_block(self, a, b, c, d, zero, one, old_zero, product):
+        '''
+        Apply [[a, b], [c, d]] to a block of zero and one amplitudes, using
+        old_zero and product of the same shape as scratch space.
+        '''
+        np.copyto(old_zero, zero)
+
+        zero *= a
+        np.multiply(one, b, out=product)
+        zero += product
+
+        one *= d
+        np.multiply(old_zero, c, out=product)
+        one += product
+
+    def _marginalize(self, probabilities, qubits):
+        '''
+        Sum basis state probabilities over all qubits not in qubits, and
+        order the remaining axes like qubits.
+        '''
+        for qubit in qubits:
+            self._check_in_range(qubit)
+
+        other = tuple(q for q in range(self.size) if q not in qubits)
+        marginal = probabilities.reshape((2,) * self.size).sum(axis=other)
+
+        kept = sorted(qubits)
+        return np.transpose(marginal, [kept.index(q) for q in qubits]).ravel()
+
+    def _project(self, indices, qubits):
+        '''
+        Turn basis state indices into integers over the given qubits.
+        '''
+        for qubit in qubits:
+            self._check_in_range(qubit)
+
+        projected = np.zeros_like(indices)
+        for qubit in qubits:
+            projected = (projected << 1) | ((indices >> (self.size - 1 - qubit)) & 1)
+
+        return projected
+
+    def _split_qubits(self, targets, controls):
+        '''
+        Return the qubits to split the state on for applying a gate in
+        parallel, the leading qubits that the gate doesn't act on. Splitting on
+        m qubits gives 2^m blocks, enough for every thread to get one.
+        '''
+        if self._executor is None:
+            return []
+
+        m = math.ceil(math.log2(self.threads))
+        free = [qubit for qubit in range(self.size)
+                if qubit not in targets and qubit not in controls]
+
+        return free[:m]
+
+    def _split(self, view):
+        '''
+        Split a view on the state into a block per thread along the longer of
+        its first and last axes. The axes in between, like the qubit axis of
+        a (2^t, 2, 2^(n-t)) view, are kept whole.
+        '''
+        if self._executor is None:
+            return [view]
+
+        axis = 0 if view.shape[0] >= view.shape[-1] else view.ndim - 1
+
+        if view.shape[axis] < 2:
+            return [view]
+
+        return np.array_split(view, min(self.threads, view.shape[axis]), axis=axis)
+
+    def _map(self, function, blocks):
+        if self._executor is None:
+            return [function(block) for block in blocks]
+
+        return list(self._executor.map(function, blocks))
+
+    def _real_qubit_view(self, target):
+        '''
+        Return a (2^target, 2, 2^(n-target)) real-valued view on the state
+        where the middle axis selects amplitudes with the target qubit 0 or 1.
+        '''
+        return self.state.view(self.state.real.dtype).reshape(
+            2**target, 2, 2**(self.size - target)
+        )
+
+
+def _blocks(view, block_size, free=None):
+    '''
+    Yield views on blocks of at most block_size elements of view (or of one
+    element of its free leading axes, if more), by indexing its leading
+    axes. Only the first free axes are indexed, the rest stay whole.
+    '''
+    if view.size <= block_size:
+        yield view
+        return
+
+    if free is None:
+        free = view.ndim
+
+    # Index the fewest leading axes that make blocks small enough
+    leading = 0
+    size = view.size
+    while leading < free and size > block_size:
+        size //= view.shape[leading]
+        leading += 1
+
+    for index in np.ndindex(*view.shape[:leading]):
+        yield view[index]
+
+
+def _complex_dtype(precision):
+    dtype = np.dtype(precision)
+
+    if dtype not in (np.complex64, np.complex128):
+        raise ValueError(
+            'Invalid precision "{}", expected complex64 or complex128'.format(precision)
+        )
+
+    return dtype
+
+
+def _pauli_sum(left, right, pauli):
+    '''
+    Return sum(conj(left[i ^ flips]) * right[i] * (-1)^parity(i & phases)) over
+    tensors of amplitudes with an axis per qubit in pauli, where X and Y flip a
+    qubit and Y and Z give a sign to a qubit that is 1.
+    '''
+    flips = tuple(q for q, p in enumerate(pauli) if p in 'XY')
+    phases = [q for q, p in enumerate(pauli) if p in 'YZ']
+
+    product = np.conj(np.flip(left, axis=flips)) * right
+
+    # Take the signs of one qubit axis at a time, from the last axis so the
+    # remaining axis numbers stay valid
+    for qubit in reversed(phases):
+        index = [slice(None)] * product.ndim
+        index[qubit] = 0
+        zero = product[tuple(index)]
+        index[qubit] = 1
+        product = zero - product[tuple(index)]
+
+    return product.sum()
+
+
+def _pauli_value(total, pauli):
+    '''
+    Turn a sum from _pauli_sum into an expectation value, with the factor i
+    for every Y (as Y = iXZ).
+    '''
+    return float((total * 1j**pauli.count('Y')).real)
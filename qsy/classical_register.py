@@ -4,18 +4,56 @@ from .register import Register
 
 
 class ClassicalRegister(Register):
+    '''
+    ClassicalRegister holds its bits as one integer, value, where bit 0 is the
+    most significant bit. Reading value needs no conversion, which keeps
+    saving the outcomes of many shots cheap.
+
+    state is a list of the bits built from value, and assigning a list to it
+    sets them all. Changing an item of that list doesn't change the
+    register, single bits are set with cr[i] = bit.
+    '''
+
     instance_counter = itertools.count()
     prefix = 'c'
 
     def __init__(self, size, name=None):
         super().__init__(size, name)
-        self.state = [0] * size
+        self.value = 0
+
+    @property
+    def state(self):
+        return [(self.value >> shift) & 1 for shift in range(self.size - 1, -1, -1)]
+
+    @state.setter
+    def state(self, state):
+        self.set_state(state)
 
     def set_state(self, state):
-        self.state = state
+        value = 0
+        for bit in state:
+            value = (value << 1) | int(bit)
+
+        self.value = value
+
+    def reset(self):
+        self.value = 0
+
+    def to_bits(self):
+        return format(self.value, '0{}b'.format(self.size))
 
     def __getitem__(self, index):
-        return self.state[index]
+        return (self.value >> self._shift(index)) & 1
 
     def __setitem__(self, index, value):
-        self.state[index] = value
+        shift = self._shift(index)
+        self.value = (self.value & ~(1 << shift)) | (int(value) << shift)
+
+    def _shift(self, index):
+        if index < 0:
+            index += self.size
+
+        if index < 0 or index >= self.size:
+            raise IndexError('classical register index out of range')
+
+        return self.size - 1 - index
@@ -4,3 +4,7 @@ class RegisterIndexError(IndexError):
 
 class InvalidRegisterError(RuntimeError):
     pass
+
+
+class InvalidObservableError(ValueError):
+    pass
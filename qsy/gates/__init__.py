@@ -1,3 +1,4 @@
+from .gate import C, CC, Gate, U
 from .pauli import *
 from .clifford import *
 from .non_clifford import *
@@ -13,3 +13,9 @@ def C(gate):
 def CC(gate):
     """Create a controlled-controlled-U gate."""
     return Gate('CC{}'.format(gate.name), gate.matrix, gate.adjoint_matrix, 3)
+
+
+def U(matrix, name='U'):
+    """Create a gate from an arbitrary unitary matrix acting on all its qubits."""
+    arity = len(matrix).bit_length() - 1
+    return Gate(name, matrix, matrix.conj().T, arity)
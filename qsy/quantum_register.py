@@ -1,6 +1,9 @@
 import itertools
 
+import numpy as np
+
 from .backends import StatevectorBackend
+from .error import InvalidObservableError
 from .register import Register
 
 
@@ -8,9 +11,10 @@ class QuantumRegister(Register):
     instance_counter = itertools.count()
     prefix = 'q'
 
-    def __init__(self, size, name=None, backend=StatevectorBackend):
+    def __init__(self, size, name=None, backend=StatevectorBackend, **options):
         super().__init__(size, name)
-        self.backend = backend(self.size, self.name)
+        # Remaining options, like precision, are passed to the back-end
+        self.backend = backend(self.size, self.name, **options)
 
     def apply_gate(self, gate, *params, adjoint=False):
         if len(params) != gate.arity:
@@ -28,8 +32,70 @@ class QuantumRegister(Register):
     def measure(self, target):
         return self.backend.measure(target)
 
+    def sample(self, shots, qubits=None):
+        '''
+        Sample shots measurement outcomes of the given qubits (all qubits by
+        default) without collapsing the state. Returns a dict mapping bit
+        strings to how often they were measured.
+        '''
+        if qubits is None:
+            qubits = range(self.size)
+
+        qubits = list(qubits)
+        outcomes, counts = np.unique(self.backend.sample(shots, qubits),
+                                     return_counts=True)
+
+        return {format(int(outcome), '0{}b'.format(len(qubits))): int(count)
+                for outcome, count in zip(outcomes, counts)}
+
+    def expectation(self, observable):
+        '''
+        Return the exact expectation value of an observable, given as a Pauli
+        string with one of I, X, Y or Z per qubit (like 'ZZI') or as a list of
+        (coefficient, Pauli string) terms.
+        '''
+        if isinstance(observable, str):
+            observable = [(1, observable)]
+
+        value = 0
+
+        for coefficient, pauli in observable:
+            pauli = pauli.upper()
+
+            if len(pauli) != self.size or any(p not in 'IXYZ' for p in pauli):
+                raise InvalidObservableError(
+                    'Invalid Pauli string "{}" for register {} ({} qubits)'.format(
+                        pauli, self.name, self.size
+                    )
+                )
+
+            if pauli.strip('I'):
+                value += coefficient * self.backend.expectation(pauli)
+            else:
+                value += coefficient
+
+        return value
+
     def yield_state(self):
         return self.backend.yield_state()
 
+    def yield_chunks(self, chunk_size=StatevectorBackend.CHUNK_SIZE):
+        return self.backend.yield_chunks(chunk_size)
+
     def to_dirac(self):
         return self.backend.to_dirac()
+
+    def reset(self):
+        '''
+        Reset the register to |0...0> in place, reusing the memory of its state.
+        '''
+        self.backend.reset()
+
+    def snapshot(self):
+        return self.backend.snapshot()
+
+    def restore(self, snapshot):
+        '''
+        Return the register to a state saved with snapshot.
+        '''
+        self.backend.restore(snapshot)
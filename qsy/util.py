@@ -12,3 +12,44 @@ def format_complex(c):
             fmt += imag_fmt
 
     return fmt
+
+
+def format_complex_array(values):
+    '''
+    Format an array of complex values like format_complex, all at once.
+    '''
+    values = np.asarray(values)
+
+    real = _strip_decimals(np.char.mod('%+.5f', values.real))
+    imag = np.char.add(_strip_decimals(np.char.mod('%+.5f', values.imag)), 'i')
+
+    formatted = np.where(np.isclose(values.real, 0.0), imag, np.char.add(real, imag))
+    return np.where(np.isclose(values.imag, 0), real, formatted)
+
+
+def format_basis_states(indices, size):
+    '''
+    Format an array of basis state indices as bit strings of size bits.
+    '''
+    shifts = np.arange(size - 1, -1, -1, dtype=np.int64)
+    bits = (np.asarray(indices, dtype=np.int64)[:, None] >> shifts) & 1
+
+    # Every row of ASCII digits is one bit string
+    digits = np.ascontiguousarray(bits.astype(np.uint8) + ord('0'))
+    return digits.view('S{}'.format(size)).ravel().astype(str)
+
+
+def format_dirac_terms(indices, amplitudes, size):
+    '''
+    Return the terms of the nonzero amplitudes among the given basis states,
+    like +0.70711|01>.
+    '''
+    nonzero = ~np.isclose(amplitudes, 0.0)
+
+    terms = np.char.add(format_complex_array(amplitudes[nonzero]), '|')
+    terms = np.char.add(terms, format_basis_states(indices[nonzero], size))
+    return np.char.add(terms, '>').tolist()
+
+
+def _strip_decimals(strings):
+    return np.char.rstrip(np.char.rstrip(strings, '0'), '.')
@@ -0,0 +1,70 @@
+import json
+import sys
+import time
+
+from .env import StateBuffers
+from .error import QsyASMError
+from .interpreter.parser import QsyASMParser
+from .program import QsyASMProgram
+
+
+def read_programs(filenames, stdin=sys.stdin):
+    '''
+    Yield (name, source) for every program to run in a batch. A filename of
+    "-" reads JSON records from stdin, one per line, with either a
+    "filename" or a "source" (and optional "name") per program. A source of
+    None means the program is read from its file.
+    '''
+    for filename in filenames:
+        if filename != '-':
+            yield filename, None
+            continue
+
+        for line in stdin:
+            if not line.strip():
+                continue
+
+            try:
+                program = json.loads(line)
+            except ValueError as e:
+                yield '<stdin>', QsyASMError('Invalid program record: {}'.format(e))
+                continue
+
+            if 'source' in program:
+                yield program.get('name', '<stdin>'), program['source']
+            else:
+                yield program.get('filename'), None
+
+
+def run_batch(args, programs, output=sys.stdout):
+    '''
+    Run many programs in one process and write a JSON record with the results
+    of every program to output, one per line. All programs share one parser
+    and a pool of state buffers, so only the first program pays for their
+    setup.
+    '''
+    parser = QsyASMParser()
+    buffers = StateBuffers()
+
+    for name, source in programs:
+        start = time.time()
+        record = {'name': name}
+
+        try:
+            if isinstance(source, QsyASMError):
+                raise source
+
+            program = QsyASMProgram(dict(args, filename=name), source=source,
+                                    parser=parser, buffers=buffers)
+            rows = program.execute()
+
+            record.update(program.record(rows))
+            program.release_buffers()
+        except Exception as e:
+            # A failing program shouldn't stop the batch
+            record['error'] = str(e)
+
+        record['time'] = time.time() - start
+
+        output.write(json.dumps(record) + '\n')
+        output.flush()
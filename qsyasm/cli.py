@@ -5,24 +5,85 @@ from qsy import __version__
 
 from .error import QsyASMError
 from .log import print_error
-from .program import QsyASMProgram
+
+
+def sweep_argument(value):
+    '''
+    Parse a name=start:stop:steps sweep into (name, start, stop, steps).
+    '''
+    try:
+        name, bounds = value.split('=')
+        start, stop, steps = bounds.split(':')
+        return name, float(start), float(stop), int(steps)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid sweep "{}", expected name=start:stop:steps'.format(value)
+        )
+
+
+def output_argument(value):
+    '''
+    Parse a format:path results output into (format, path).
+    '''
+    output_format, _, path = value.partition(':')
+
+    if output_format not in ('jsonl', 'csv', 'npz') or not path:
+        raise argparse.ArgumentTypeError(
+            'invalid output "{}", expected jsonl:PATH, csv:PATH or npz:PATH'.format(value)
+        )
+
+    return output_format, path
 
 
 def main():
     argparser = argparse.ArgumentParser(description='qsyasm assembly runner')
 
-    argparser.add_argument('filename', type=str, help='qsyasm file to execute')
+    argparser.add_argument('filename', type=str, nargs='+',
+                           help='qsyasm file to execute, or files with --batch ("-" reads programs from stdin)')
     argparser.add_argument('-V', '--version', action='version',
                            version='%(prog)s v' + __version__)
     argparser.add_argument('-v', '--verbose', action='store_true',
                            help='verbose output')
     argparser.add_argument('-t', '--time', action='store_true',
                            help='time program execution')
-    argparser.add_argument('-b', '--backend', choices=('chp', 'statevector'),
+    argparser.add_argument('-b', '--backend', choices=('chp', 'statevector', 'sparse', 'memmap'),
                            default=None, metavar='B',
-                           help='simulator back-end to use: chp or statevector (default: statevector)')
+                           help='simulator back-end to use: chp, statevector, sparse or memmap (default: chosen per register)')
+    argparser.add_argument('-p', '--precision', choices=('complex64', 'complex128'),
+                           default='complex128', metavar='P',
+                           help='precision of state amplitudes: complex64 or complex128 (default: complex128)')
+    argparser.add_argument('--threads', type=int, default=1,
+                           help='amount of threads to apply statevector gates with (default: 1)')
+    argparser.add_argument('--state-dir', type=str, default=None, metavar='DIR',
+                           help='directory to keep memmap register states in, existing states are resumed')
     argparser.add_argument('-s', '--shots', type=int, default=1,
                            help='amount of shots to run')
+    argparser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='amount of processes to run shots in (default: 1)')
+    argparser.add_argument('--seed', type=int, default=None,
+                           help='seed for the random number generator')
+    argparser.add_argument('--sweep', type=sweep_argument, action='append', default=None,
+                           metavar='NAME=START:STOP:STEPS',
+                           help='run the program for STEPS values of parameter NAME from START to STOP and print the results as a table (can be repeated)')
+    argparser.add_argument('--no-fusion', action='store_true',
+                           help='don\'t fuse gates before execution')
+    argparser.add_argument('--no-checkpoint', action='store_true',
+                           help='run every shot from the start instead of from a copy of the state before the first measurement, which takes memory for a copy of every register')
+    argparser.add_argument('--stream', action='store_true',
+                           help='execute the program while reading it, for very large programs (single shot, registers use the statevector back-end unless -b is given)')
+    argparser.add_argument('-o', '--output', type=output_argument, default=None,
+                           metavar='FORMAT:PATH',
+                           help='write the results to PATH as jsonl, csv or npz instead of printing them')
+    argparser.add_argument('--dump-state', type=str, default=None, metavar='DIR',
+                           help='write the state of every quantum register to a file in DIR, of any register size')
+    argparser.add_argument('--dump-format', choices=('npy', 'raw'), default='npy',
+                           help='format of the state files: npy, or raw amplitudes (default: npy)')
+    argparser.add_argument('--profile', type=str, default=None, metavar='PATH',
+                           help='write a profile of the time spent per phase, operation and register to PATH')
+    argparser.add_argument('--profile-format', choices=('json', 'folded'), default='json',
+                           help='format of the profile: json, or folded stacks for flame graph tools (default: json)')
+    argparser.add_argument('--batch', action='store_true',
+                           help='run all files in one process and print a JSON record per program')
     argparser.add_argument('--ignore-print-warning', action='store_true',
                            help='ignore register too large to print warning')
     argparser.add_argument('--skip-zero-amplitudes', action='store_true',
@@ -30,9 +91,44 @@ def main():
 
     args = vars(argparser.parse_args())
 
+    if not args['batch'] and len(args['filename']) > 1:
+        argparser.error('multiple files can only be run with --batch')
+
+    if args['batch'] and args['stream']:
+        argparser.error('--stream can\'t be combined with --batch')
+
+    if args['output'] is not None and (args['batch'] or args['sweep']):
+        argparser.error('--output can\'t be combined with --batch or --sweep')
+
+    if args['batch'] and args['profile']:
+        argparser.error('--profile can\'t be combined with --batch')
+
+    # Imported after parsing arguments, so --help and --version don't have to
+    # load the simulator
+    from .batch import read_programs, run_batch
+    from .program import QsyASMProgram
+
+    if args['batch']:
+        run_batch(args, read_programs(args.pop('filename')))
+        return
+
+    args['filename'] = args['filename'][0]
+    profiler = None
+
+    if args['profile'] is not None:
+        from .profiler import Profiler
+        profiler = Profiler()
+
     try:
-        p = QsyASMProgram(args)
+        p = QsyASMProgram(args, profiler=profiler)
         p.run()
     except QsyASMError as e:
         print_error(e)
         sys.exit(-1)
+
+    if profiler is not None:
+        try:
+            profiler.write(args['profile'], args['profile_format'])
+        except Exception as e:
+            print_error('Error writing profile: {}'.format(str(e)))
+            sys.exit(-1)
@@ -0,0 +1,263 @@
+import numpy as np
+
+from qsy import gates
+
+from .instruction import Instruction, Operation
+
+
+class QsyASMCompiler:
+    '''
+    QsyASMCompiler runs between parsing and evaluation and reduces the number
+    of gates applied to the state. Consecutive gates acting on at most two
+    qubits of the same register are fused into one 2x2 or 4x4 unitary, and
+    gates that multiply to the identity are removed. On registers in
+    cancel_only (e.g. those using the CHP back-end, which only supports
+    Clifford gates) only adjacent inverse pairs on the same qubits are
+    cancelled.
+
+    Instructions are compiled in a single pass, so a program can be compiled
+    while it's being parsed and executed.
+    '''
+
+    MAX_FUSED_QUBITS = 2
+    # Amount of instructions gates can be fused across
+    WINDOW = 4096
+
+    def __init__(self, cancel_only=()):
+        self.cancel_only = set(cancel_only)
+
+    def compile(self, instructions):
+        return list(self.stream(instructions))
+
+    def stream(self, instructions):
+        '''
+        Compile instructions from an iterable, yielding compiled instructions
+        as soon as no later gate can be fused into them. Gates more than WINDOW
+        instructions back are no longer fused, so only a window of the program
+        is kept in memory.
+        '''
+        # Instructions not yielded yet by index, None for fused gates
+        output = {}
+        # Index of the next instruction to yield and to add to output
+        emitted = 0
+        count = 0
+
+        # Index in output of the last instruction on each (register, qubit)
+        # wire, for fusable gates only
+        last = {}
+        # Wires and matrix of every fusable gate in output
+        blocks = {}
+        # Size of every quantum register defined so far
+        sizes = {}
+
+        for instr in instructions:
+            if count - emitted >= 2*self.WINDOW:
+                yield from self._flush(output, emitted, count - self.WINDOW, last, blocks)
+                emitted = count - self.WINDOW
+
+            if not instr.is_gate():
+                self._barrier(instr, last, sizes)
+                output[count] = instr
+                count += 1
+                continue
+
+            wires = self._wires(instr, sizes)
+
+            if wires is None:
+                # Not fusable, nothing can be moved past it
+                for arg in instr.args:
+                    if isinstance(arg, tuple):
+                        last.pop(arg, None)
+
+                output[count] = instr
+                count += 1
+                continue
+
+            matrix = self._matrix(instr)
+            candidates = sorted({last[wire] for wire in wires if wire in last})
+            merged = self._merge(candidates, wires, matrix, last, blocks)
+
+            if merged is None:
+                output[count] = instr
+                blocks[count] = (wires, matrix)
+
+                for wire in wires:
+                    last[wire] = count
+
+                count += 1
+                continue
+
+            union, fused = merged
+
+            for candidate in candidates:
+                output[candidate] = None
+                del blocks[candidate]
+
+            for wire in union:
+                last.pop(wire, None)
+
+            if self._is_identity(fused):
+                continue
+
+            output[count] = Instruction('u', union, instr.lineno, instr.lexpos,
+                                        gate=gates.U(fused))
+            blocks[count] = (union, fused)
+
+            for wire in union:
+                last[wire] = count
+
+            count += 1
+
+        yield from self._flush(output, emitted, count, last, blocks)
+
+    def _flush(self, output, start, end, last, blocks):
+        '''
+        Yield the instructions with an index in [start, end) and stop fusing
+        gates into them.
+        '''
+        for wire in [wire for wire, index in last.items() if index < end]:
+            del last[wire]
+
+        for index in range(start, end):
+            blocks.pop(index, None)
+            instr = output.pop(index)
+
+            if instr is not None:
+                yield instr
+
+    def _merge(self, candidates, wires, matrix, last, blocks):
+        '''
+        Try to fuse the gate with the last gates on its wires. Returns the
+        wires and matrix of the fused gate, or None if it can't be fused.
+        '''
+        if not candidates:
+            return None
+
+        union = list(wires)
+
+        for candidate in candidates:
+            candidate_wires, _ = blocks[candidate]
+
+            # The candidate can only be moved up to this gate if nothing was
+            # applied to any of its wires after it
+            if any(last.get(wire) != candidate for wire in candidate_wires):
+                return None
+
+            union += [wire for wire in candidate_wires if wire not in union]
+
+        registers = {register for register, _ in union}
+
+        if len(registers) != 1:
+            return None
+
+        fuse = not registers & self.cancel_only
+
+        if fuse:
+            if len(union) > self.MAX_FUSED_QUBITS:
+                return None
+        elif len(candidates) != 1 or blocks[candidates[0]][0] != wires:
+            return None
+
+        fused = np.eye(2**len(union))
+
+        for candidate in candidates:
+            candidate_wires, candidate_matrix = blocks[candidate]
+            fused = self._expand(candidate_matrix, candidate_wires, union) @ fused
+
+        fused = self._expand(matrix, wires, union) @ fused
+
+        if not fuse and not self._is_identity(fused):
+            return None
+
+        return union, fused
+
+    def _barrier(self, instr, last, sizes):
+        '''
+        Stop fusion across measurements, expectation values and register
+        (re)definitions, and record the size of defined registers.
+        '''
+        if instr.type == Operation.EXPECT:
+            self._clear_register(instr.args[0], last)
+        elif instr.type == Operation.MEASURE:
+            qtarget = instr.args[0]
+
+            if isinstance(qtarget, tuple):
+                last.pop(qtarget, None)
+            else:
+                self._clear_register(qtarget, last)
+        elif instr.type == Operation.QR:
+            size = instr.op[1] if len(instr.op) == 2 else None
+
+            for register in instr.args:
+                self._clear_register(register, last)
+
+                if isinstance(size, int) and size > 0:
+                    sizes[register] = size
+                else:
+                    # Invalid definitions are reported by the evaluator
+                    sizes.pop(register, None)
+
+    def _clear_register(self, register, last):
+        for wire in [wire for wire in last if wire[0] == register]:
+            del last[wire]
+
+    def _wires(self, instr, sizes):
+        '''
+        Return the (register, qubit) wires of a gate, or None if the gate acts
+        on more qubits than can be fused, has symbolic parameters or has
+        arguments that are left for the evaluator to report. Gates on undefined
+        registers or out of range qubits are never fused, so they can't be
+        cancelled before the evaluator reports them.
+        '''
+        if not all(isinstance(arg, tuple) for arg in instr.args):
+            return None
+
+        if not all(register in sizes and 0 <= qubit < sizes[register]
+                   for register, qubit in instr.args):
+            return None
+
+        if instr.parameters():
+            # The matrix changes every time parameters are bound
+            return None
+
+        wires = list(instr.args)
+
+        if len(wires) > self.MAX_FUSED_QUBITS or len(set(wires)) != len(wires):
+            return None
+
+        return wires
+
+    def _matrix(self, instr):
+        '''
+        Return the matrix of a gate on its wires, in argument order.
+        '''
+        gate = instr.get_gate()
+        operation = gate.adjoint_matrix if instr.adjoint else gate.matrix
+
+        if len(operation) == 2**len(instr.args):
+            return operation
+
+        # Controlled gate: identity unless the control is 1
+        matrix = np.eye(4, dtype=complex)
+        matrix[2:, 2:] = operation
+        return matrix
+
+    def _expand(self, matrix, wires, union):
+        '''
+        Expand a matrix acting on wires to a matrix acting on all union wires.
+        '''
+        n = len(union)
+
+        missing = [wire for wire in union if wire not in wires]
+        full = np.kron(matrix, np.eye(2**len(missing)))
+
+        # Reorder the axes of the expanded matrix to the order of union
+        order = wires + missing
+        permutation = [order.index(wire) for wire in union]
+
+        full = full.reshape((2,) * 2*n)
+        full = full.transpose(permutation + [n + i for i in permutation])
+        return full.reshape(2**n, 2**n)
+
+    def _is_identity(self, matrix):
+        return np.allclose(matrix, np.eye(len(matrix)))
@@ -1,3 +1,7 @@
+from collections import defaultdict
+
+import numpy as np
+
 from qsy import ClassicalRegister, QuantumRegister
 from qsy.error import RegisterIndexError
 
@@ -21,8 +25,28 @@ class Env:
 
         return self.crs[name]
 
-    def create_qr(self, name, size, backend):
-        self.qrs[name] = QuantumRegister(size, name, backend=backend)
+    def create_qr(self, name, size, backend, **options):
+        self.qrs[name] = QuantumRegister(size, name, backend=backend, **options)
+        return self.qrs[name]
 
     def create_cr(self, name, size):
         self.crs[name] = ClassicalRegister(size, name)
+        return self.crs[name]
+
+
+class StateBuffers:
+    '''
+    Pool of state vector buffers of registers that are no longer used, so new
+    registers of the same size and precision (in the next shot, or the next
+    program of a batch) can reuse them instead of allocating.
+    '''
+
+    def __init__(self):
+        self.free = defaultdict(list)
+
+    def take(self, size, precision):
+        buffers = self.free[(size, np.dtype(precision))]
+        return buffers.pop() if buffers else None
+
+    def release(self, state):
+        self.free[(len(state).bit_length() - 1, state.dtype)].append(state)
@@ -0,0 +1,71 @@
+import operator
+
+OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '**': operator.pow
+}
+
+
+class Expression:
+    '''
+    Expression over symbolic parameters, like the angle in rx(theta/2). The
+    parser folds expressions without parameters to constants, so an
+    Expression always depends on at least one parameter. It is evaluated each
+    time values are bound to its parameters.
+
+    An expression is stored as a tree of plain data: op is the name of a
+    parameter for op 'parameter', or an operator applied to operands, which
+    are constants or expressions. Expressions can be pickled, so programs
+    with parameters can be sent to worker processes.
+    '''
+
+    __slots__ = ('op', 'operands', 'names')
+
+    def __init__(self, op, operands, names):
+        self.op = op
+        self.operands = operands
+        self.names = frozenset(names)
+
+    @classmethod
+    def parameter(cls, name):
+        return cls('parameter', (name,), [name])
+
+    @classmethod
+    def binary(cls, op, left, right):
+        '''
+        Combine two operands, constants or expressions, with a binary operator.
+        '''
+        return cls(op, (left, right), _names(left) | _names(right))
+
+    def __neg__(self):
+        return Expression('neg', (self,), self.names)
+
+    def evaluate(self, bindings):
+        if self.op == 'parameter':
+            return bindings[self.operands[0]]
+
+        if self.op == 'neg':
+            return -_evaluate(self.operands[0], bindings)
+
+        left, right = self.operands
+        return OPERATORS[self.op](_evaluate(left, bindings), _evaluate(right, bindings))
+
+    def __repr__(self):
+        return '{}<{}>'.format(self.__class__.__name__, ', '.join(sorted(self.names)))
+
+
+def _evaluate(operand, bindings):
+    if isinstance(operand, Expression):
+        return operand.evaluate(bindings)
+
+    return operand
+
+
+def _names(operand):
+    if isinstance(operand, Expression):
+        return operand.names
+
+    return frozenset()
@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class Histogram:
+    '''
+    Histogram counts the outcomes of a classical register over many shots.
+    Outcomes are the integer values of the register, its first bit the most
+    significant, and are only formatted as bit strings when printed.
+
+    Registers of up to DENSE_BITS bits count into an array with an entry per
+    outcome, wider registers into a dict of the outcomes that occurred.
+    '''
+
+    DENSE_BITS = 16
+
+    def __init__(self, size):
+        self.size = size
+        self.counts = self._empty_counts(size)
+
+    def resize(self, size):
+        '''
+        Change the size of the register, for registers that are redefined.
+        Counts of outcomes that don't fit in the new size are dropped.
+        '''
+        items = self.items()
+
+        self.size = size
+        self.counts = self._empty_counts(size)
+
+        for outcome, count in items:
+            if outcome >> size == 0:
+                self.add(outcome, count)
+
+    def add(self, outcome, count=1):
+        self.counts[outcome] += count
+
+    def add_outcomes(self, outcomes):
+        '''
+        Count the outcomes of many shots at once, given as an array with an
+        integer outcome per shot.
+        '''
+        if isinstance(self.counts, np.ndarray):
+            self.counts += np.bincount(outcomes.astype(np.int64), minlength=len(self.counts))
+            return
+
+        outcomes, counts = np.unique(outcomes, return_counts=True)
+
+        for outcome, count in zip(outcomes.tolist(), counts.tolist()):
+            self.counts[outcome] += count
+
+    def merge(self, other):
+        for outcome, count in other.items():
+            self.counts[outcome] += count
+
+    def items(self):
+        '''
+        Return the outcomes that occurred and their counts, by outcome.
+        '''
+        if isinstance(self.counts, np.ndarray):
+            outcomes = np.flatnonzero(self.counts)
+            return list(zip(outcomes.tolist(), self.counts[outcomes].tolist()))
+
+        return sorted(self.counts.items())
+
+    def to_arrays(self):
+        '''
+        Return the outcomes that occurred and their counts as arrays.
+        '''
+        if isinstance(self.counts, np.ndarray):
+            outcomes = np.flatnonzero(self.counts)
+            return outcomes, self.counts[outcomes]
+
+        items = self.items()
+        dtype = np.int64 if self.size <= 63 else object
+
+        return (np.array([outcome for outcome, _ in items], dtype=dtype),
+                np.array([count for _, count in items], dtype=np.int64))
+
+    def _empty_counts(self, size):
+        if size <= self.DENSE_BITS:
+            return np.zeros(2**size, dtype=np.int64)
+
+        return defaultdict(int)
+
+    def to_dict(self):
+        '''
+        Return the counts by bit string.
+        '''
+        return {format(outcome, '0{}b'.format(self.size)): count
+                for outcome, count in self.items()}
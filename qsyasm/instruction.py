@@ -1,6 +1,9 @@
 from enum import IntEnum, auto, unique
 
+from qsy import gates
+
 from .error import QsyASMError
+from .expression import Expression
 
 
 @unique
@@ -26,6 +29,9 @@ class Operation(IntEnum):
     CRY = auto()
     CRZ = auto()
     CCX = auto()
+
+    # Fused unitary, only produced by the compiler
+    U = auto()
     GATES_END = auto()
 
     # Registers
@@ -33,6 +39,7 @@ class Operation(IntEnum):
     CR = auto()
 
     MEASURE = auto()
+    EXPECT = auto()
 
     ERROR = auto()
 
@@ -61,41 +68,104 @@ operations = {
     'creg': Operation.CR,
 
     'meas': Operation.MEASURE,
+    'expect': Operation.EXPECT,
 
     'error': Operation.ERROR
 }
 
 
+OPERATION_GATES = {
+    Operation.I: gates.I,
+    Operation.X: gates.X,
+    Operation.Y: gates.Y,
+    Operation.Z: gates.Z,
+
+    Operation.H: gates.H,
+    Operation.S: gates.S,
+    Operation.CX: gates.CX,
+    Operation.CY: gates.CY,
+    Operation.CZ: gates.CZ,
+
+    Operation.T: gates.T,
+    Operation.RX: gates.Rx,
+    Operation.RY: gates.Ry,
+    Operation.RZ: gates.Rz,
+    Operation.CRX: gates.CRx,
+    Operation.CRY: gates.CRy,
+    Operation.CRZ: gates.CRz,
+    Operation.CCX: gates.CCX
+}
+
+
 class Instruction:
-    def __init__(self, op, args, lineno, lexpos):
+    # Programs can have millions of instructions, so they don't get a
+    # per-instance __dict__
+    __slots__ = ('op', 'args', 'lineno', 'lexpos', 'gate', 'type', 'adjoint')
+
+    def __init__(self, op, args, lineno, lexpos, gate=None):
         self.op = op
-        self.op_name = op
-        self.args = args
+        self.args = tuple(args)
         self.lineno = lineno
         self.lexpos = lexpos
 
+        # only applicable for fused gates
+        self.gate = gate
+
         self.type = self._get_op_type()
 
         # only applicable for gates
         self.adjoint = False
 
+    @property
+    def op_name(self):
+        if isinstance(self.op, tuple):
+            # parameterized instruction like qreg[n] or c(x)
+            return self.op[0]
+
+        return self.op
+
     def is_gate(self):
         return self.type > Operation.GATES_START and self.type < Operation.GATES_END
 
     def toggle_adjoint(self):
         self.adjoint = not self.adjoint
 
-    def _get_op_type(self):
-        self.op_name = self.op
+    def parameters(self):
+        '''
+        Return the names of the symbolic parameters of a gate argument.
+        '''
+        if self.is_gate() and isinstance(self.op, tuple) and \
+                isinstance(self.op[1], Expression):
+            return self.op[1].names
 
-        if isinstance(self.op, tuple):
-            # parameterized instruction like qreg[n] or c(x)
-            self.op_name, _ = self.op
+        return frozenset()
+
+    def get_gate(self, bindings=None):
+        '''
+        Return the qsy gate applied by this instruction, building the matrix of
+        parameterized gates from the instruction argument. Symbolic arguments
+        are evaluated with the parameter values in bindings.
+        '''
+        if self.gate is not None:
+            return self.gate
+
+        gate = OPERATION_GATES[self.type]
 
-        if self.op_name not in operations:
-            return Operation.ERROR
+        if callable(gate):
+            gate_arg = self.op[1]
+
+            if isinstance(gate_arg, Expression):
+                gate_arg = gate_arg.evaluate(bindings)
+
+            gate = gate(gate_arg)
+
+        return gate
+
+    def _get_op_type(self):
+        if self.gate is not None:
+            return Operation.U
 
-        return operations[self.op_name]
+        return operations.get(self.op_name, Operation.ERROR)
 
     def __repr__(self):
         return '{}<{} {}>'.format(self.__class__.__name__, self.op, self.args)
@@ -1,3 +1,5 @@
+import sys
+
 import ply.lex as lex
 
 from qsyasm.error import ParseError
@@ -45,6 +47,8 @@ class QsyASMLexer:
 
     def t_IDENT(self, t):
         r'[a-zA-Z_][a-zA-Z0-9_]*'
+        # Operation and register names repeat on every line, share one copy
+        t.value = sys.intern(t.value)
         t.type = self.reserved.get(t.value, 'IDENT')
         return t
 
@@ -65,6 +69,3 @@ class QsyASMLexer:
 
     def t_error(self, t):
         raise ParseError('Unknown token "{}"'.format(t.value[0]), t)
-
-
-lexer = QsyASMLexer()
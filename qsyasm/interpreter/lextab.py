@@ -0,0 +1,10 @@
+# lextab.py. This file automatically created by PLY (version 3.11). Don't edit!
+_tabversion   = '3.10'
+_lextokens    = set(('ADJ', 'COMMA', 'DIV', 'FLOAT', 'IDENT', 'INTEGER', 'LBRACKET', 'LPAREN', 'MIN', 'MUL', 'NEWLINE', 'PLUS', 'POW', 'RBRACKET', 'RPAREN'))
+_lexreflags   = 64
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_IDENT>[a-zA-Z_][a-zA-Z0-9_]*)|(?P<t_INTEGER>\\d+)|(?P<t_FLOAT>\\d+\\.\\d+)|(?P<t_NEWLINE>\\n+)|(?P<t_POW>\\*\\*)|(?P<t_ignore_COMMENT>;.*)|(?P<t_LBRACKET>\\[)|(?P<t_LPAREN>\\()|(?P<t_MUL>\\*)|(?P<t_PLUS>\\+)|(?P<t_RBRACKET>\\])|(?P<t_RPAREN>\\))|(?P<t_COMMA>,)|(?P<t_DIV>/)|(?P<t_MIN>-)', [None, ('t_IDENT', 'IDENT'), ('t_INTEGER', 'INTEGER'), ('t_FLOAT', 'FLOAT'), ('t_NEWLINE', 'NEWLINE'), (None, 'POW'), (None, None), (None, 'LBRACKET'), (None, 'LPAREN'), (None, 'MUL'), (None, 'PLUS'), (None, 'RBRACKET'), (None, 'RPAREN'), (None, 'COMMA'), (None, 'DIV'), (None, 'MIN')])]}
+_lexstateignore = {'INITIAL': '\t\r '}
+_lexstateerrorf = {'INITIAL': 't_error'}
+_lexstateeoff = {}
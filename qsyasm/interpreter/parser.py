@@ -1,9 +1,11 @@
 import itertools
+import math
+import os
 
-import numpy as np
 import ply.yacc as yacc
 
 from qsyasm.error import ParseError
+from qsyasm.expression import Expression
 from qsyasm.instruction import Instruction
 
 from .lexer import QsyASMLexer
@@ -18,11 +20,22 @@ class QsyASMParser:
         ('right', 'UMIN')
     )
     variables = {
-        'pi': np.pi
+        'pi': math.pi
     }
 
     def __init__(self, **kwargs):
-        self.parser = yacc.yacc(module=self, **kwargs)
+        # Lexer and parser tables are generated once into lextab.py and
+        # parsetab.py and loaded from there without analysing the grammar, so
+        # delete them after changing the grammar
+        table_dir = os.path.dirname(__file__)
+
+        self.lookups = {}
+
+        self.lexer = QsyASMLexer(optimize=True, lextab='qsyasm.interpreter.lextab',
+                                 outputdir=table_dir)
+        self.parser = yacc.yacc(module=self, debug=False, optimize=True,
+                                tabmodule='qsyasm.interpreter.parsetab',
+                                outputdir=table_dir, **kwargs)
 
     def p_program(self, p):
         '''program : program instruction
@@ -36,7 +49,7 @@ class QsyASMParser:
                 p[0] = []
 
             if p[2]:
-                p[0] += [p[2]]
+                p[0].append(p[2])
 
     def p_instruction(self, p):
         '''instruction : normal_instruction
@@ -71,7 +84,10 @@ class QsyASMParser:
 
     def p_lookup(self, p):
         'lookup : IDENT LBRACKET INTEGER RBRACKET'
-        p[0] = (p[1], p[3])
+        lookup = (p[1], p[3])
+
+        # Share one tuple between all lookups of the same qubit or bit
+        p[0] = self.lookups.setdefault(lookup, lookup)
 
     def p_param_term(self, p):
         'param_term : IDENT LPAREN expression RPAREN'
@@ -92,7 +108,10 @@ class QsyASMParser:
                       | expression DIV expression
                       | expression POW expression
                       | expression MUL expression'''
-        if p[2] == '+':
+        if isinstance(p[1], Expression) or isinstance(p[3], Expression):
+            # Depends on a parameter, evaluated when values are bound
+            p[0] = Expression.binary(p[2], p[1], p[3])
+        elif p[2] == '+':
             p[0] = p[1] + p[3]
         elif p[2] == '-':
             p[0] = p[1] - p[3]
@@ -123,16 +142,35 @@ class QsyASMParser:
 
     def p_expression_ident(self, p):
         'expression : IDENT'
-        if p[1] not in self.variables:
-            raise ParseError(
-                'Undefined variable "{}"'.format(p[1]),
-                p.lexpos(1), p.lineno(1)
-            )
-
-        p[0] = self.variables[p[1]]
+        if p[1] in self.variables:
+            p[0] = self.variables[p[1]]
+        else:
+            # Symbolic parameter, bound before the program is executed
+            p[0] = Expression.parameter(p[1])
 
     def p_error(self, p):
         raise ParseError('Unexpected "{}"'.format(p.type), p.lexpos, p.lineno)
 
     def parse(self, s):
-        return self.parser.parse(s, debug=False, tracking=True)
+        # The lexer is reused between programs
+        self.lexer.lexer.lineno = 1
+
+        return self.parser.parse(s, lexer=self.lexer.lexer, debug=False, tracking=True)
+
+    def parse_lines(self, lines):
+        '''
+        Parse a program line by line and yield its instructions as they're
+        parsed, so the program never has to be in memory as a whole. No
+        instruction spans multiple lines. Positions of the yielded
+        instructions are relative to the start of their line.
+        '''
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+
+            self.lexer.lexer.lineno = lineno
+            instructions = self.parser.parse(line, lexer=self.lexer.lexer, debug=False,
+                                             tracking=True)
+
+            if instructions:
+                yield from instructions
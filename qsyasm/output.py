@@ -0,0 +1,152 @@
+import csv
+import json
+
+import numpy as np
+
+from qsy import __version__
+
+from .error import QsyASMError
+
+
+def write_results(program, output_format, path, elapsed):
+    '''
+    Write the results of an executed program to path as JSON lines, CSV or a
+    compressed NPZ archive: metadata, the values of classical registers, shot
+    histograms, expectation values and the nonzero amplitudes of quantum
+    registers. Histograms are arrays of outcomes, the integer value of the
+    measured bits with the first bit the most significant, and their counts.
+    '''
+    writer = {'jsonl': _write_jsonl, 'csv': _write_csv, 'npz': _write_npz}[output_format]
+
+    try:
+        writer(_records(program, elapsed), path)
+    except OSError as e:
+        raise QsyASMError('Error writing output: {}'.format(str(e)))
+
+
+def _records(program, elapsed):
+    yield {
+        'type': 'metadata',
+        'filename': program.filename,
+        'version': __version__,
+        'shots': program.shots,
+        'seed': program.seed,
+        'time': elapsed,
+        'backends': program.backends
+    }
+
+    for cr_name, cr in program.env.crs.items():
+        yield {'type': 'classical', 'register': cr_name,
+               'bits': np.array(cr.state, dtype=np.int8)}
+
+    for cr_name, histogram in program.measurement_results.items():
+        outcomes, counts = histogram.to_arrays()
+        yield {'type': 'histogram', 'register': cr_name, 'outcomes': outcomes,
+               'counts': counts}
+
+    for (qr_name, pauli), (total, count) in program.expectation_results.items():
+        yield {'type': 'expectation', 'register': qr_name, 'pauli': pauli,
+               'value': total / count}
+
+    for qr_name, qr in program.env.qrs.items():
+        if program.backends[qr_name] == 'chp':
+            # No amplitudes to write
+            continue
+
+        for indices, amplitudes in qr.yield_chunks():
+            nonzero = ~np.isclose(amplitudes, 0.0)
+
+            if nonzero.any():
+                yield {'type': 'state', 'register': qr_name,
+                       'indices': indices[nonzero], 'amplitudes': amplitudes[nonzero]}
+
+
+def _write_jsonl(records, path):
+    with open(path, 'w') as f:
+        for record in records:
+            if record['type'] == 'classical':
+                bits = record.pop('bits')
+                record['bits'] = ''.join(str(bit) for bit in bits)
+                record['value'] = int(record['bits'] or '0', 2)
+            elif record['type'] == 'state':
+                amplitudes = record.pop('amplitudes')
+                record['real'] = amplitudes.real.tolist()
+                record['imag'] = amplitudes.imag.tolist()
+
+            record = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                      for key, value in record.items()}
+
+            f.write(json.dumps(record) + '\n')
+
+
+def _write_csv(records, path):
+    '''
+    Write records as type,register,key,value,imag rows: metadata fields,
+    the bits of classical registers, histogram outcomes with their count,
+    expectation values by Pauli string and amplitudes by basis state index.
+    '''
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('type', 'register', 'key', 'value', 'imag'))
+
+        for record in records:
+            kind = record['type']
+            register = record.get('register', '')
+
+            if kind == 'metadata':
+                for key, value in record.items():
+                    if key == 'backends':
+                        value = json.dumps(value)
+
+                    if key != 'type':
+                        writer.writerow((kind, '', key, value, ''))
+            elif kind == 'classical':
+                bits = ''.join(str(bit) for bit in record['bits'])
+                writer.writerow((kind, register, 'bits', bits, ''))
+            elif kind == 'histogram':
+                writer.writerows((kind, register, outcome, count, '')
+                                 for outcome, count in zip(record['outcomes'].tolist(),
+                                                           record['counts'].tolist()))
+            elif kind == 'expectation':
+                writer.writerow((kind, register, record['pauli'], record['value'], ''))
+            elif kind == 'state':
+                amplitudes = record['amplitudes']
+                writer.writerows(zip((kind,) * len(amplitudes), (register,) * len(amplitudes),
+                                     record['indices'].tolist(), amplitudes.real.tolist(),
+                                     amplitudes.imag.tolist()))
+
+
+def _write_npz(records, path):
+    '''
+    Write records as arrays named <type>/<register>/<field>: classical/c/bits,
+    histogram/c/outcomes, histogram/c/counts, expectation/q/<pauli>,
+    state/q/indices and state/q/amplitudes, and the metadata as a JSON
+    string in metadata.
+    '''
+    arrays = {}
+    states = {}
+
+    for record in records:
+        kind = record['type']
+
+        if kind == 'metadata':
+            arrays['metadata'] = np.array(json.dumps(record))
+        elif kind == 'classical':
+            arrays['classical/{}/bits'.format(record['register'])] = record['bits']
+        elif kind == 'histogram':
+            arrays['histogram/{}/outcomes'.format(record['register'])] = record['outcomes']
+            arrays['histogram/{}/counts'.format(record['register'])] = record['counts']
+        elif kind == 'expectation':
+            name = 'expectation/{}/{}'.format(record['register'], record['pauli'])
+            arrays[name] = np.array(record['value'])
+        elif kind == 'state':
+            chunks = states.setdefault(record['register'], ([], []))
+            chunks[0].append(record['indices'])
+            chunks[1].append(record['amplitudes'])
+
+    for qr_name, (indices, amplitudes) in states.items():
+        arrays['state/{}/indices'.format(qr_name)] = np.concatenate(indices)
+        arrays['state/{}/amplitudes'.format(qr_name)] = np.concatenate(amplitudes)
+
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
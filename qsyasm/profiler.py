@@ -0,0 +1,129 @@
+import contextlib
+import json
+import time
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+
+class Profiler:
+    '''
+    Profiler collects where the time of a qsyasm program goes: the time of
+    every phase (parsing, compiling, lowering, executing, ...), the count and
+    time of every executed operation per register, and the peak memory of
+    the state of every quantum register.
+
+    Pass a Profiler to QsyASMProgram to profile a program. Without one the
+    program doesn't time anything.
+    '''
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        # Phase every phase first ran in, and the phases running now
+        self.parents = {}
+        self._running = []
+        # Count and time of every (register, operation)
+        self.steps = defaultdict(lambda: [0, 0.0])
+        self.backends = {}
+        self.peak_state_bytes = defaultdict(int)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.parents.setdefault(name, self._running[-1] if self._running else None)
+        self._running.append(name)
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+            self._running.pop()
+
+    def step(self, register, operation, seconds):
+        step = self.steps[register, operation]
+        step[0] += 1
+        step[1] += seconds
+
+    def state(self, register, backend_name, backend):
+        '''
+        Record the memory used by the state of a quantum register.
+        '''
+        self.backends[register] = backend_name
+        self.peak_state_bytes[register] = max(self.peak_state_bytes[register],
+                                              _state_bytes(backend))
+
+    def to_dict(self):
+        operations = defaultdict(lambda: {'count': 0, 'time': 0.0})
+        registers = OrderedDict()
+
+        for (register, operation), (count, seconds) in self.steps.items():
+            operations[operation]['count'] += count
+            operations[operation]['time'] += seconds
+
+            if register not in registers:
+                registers[register] = {'backend': self.backends.get(register),
+                                       'count': 0, 'time': 0.0,
+                                       'peak_state_bytes': self.peak_state_bytes.get(register)}
+
+            registers[register]['count'] += count
+            registers[register]['time'] += seconds
+
+        return {
+            'phases': dict(self.phases),
+            'operations': dict(operations),
+            'registers': dict(registers)
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_folded(self):
+        '''
+        Return the profile as folded stacks, one "frame;frame;... time" line
+        per stack with the time in microseconds, which is read by flame graph
+        tools like flamegraph.pl and speedscope. Phases are nested in the
+        phase they ran in, and operations in the execute phase per register.
+        '''
+        # Time of every phase spent in the phases and operations within it
+        nested = defaultdict(float)
+        nested['execute'] = sum(seconds for _, seconds in self.steps.values())
+
+        for name, seconds in self.phases.items():
+            if self.parents[name] is not None:
+                nested[self.parents[name]] += seconds
+
+        lines = []
+
+        for name, seconds in self.phases.items():
+            lines.append('{} {}'.format(self._stack(name),
+                                        _microseconds(max(seconds - nested[name], 0.0))))
+
+        for (register, operation), (_, seconds) in self.steps.items():
+            lines.append('{};{};{} {}'.format(self._stack('execute'), register, operation,
+                                              _microseconds(seconds)))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, output_format='json'):
+        output = self.to_folded() if output_format == 'folded' else self.to_json()
+
+        with open(path, 'w') as f:
+            f.write(output)
+
+    def _stack(self, name):
+        frames = []
+
+        while name is not None:
+            frames.append(name)
+            name = self.parents.get(name)
+
+        return ';'.join(['qsyasm'] + frames[::-1])
+
+
+def _state_bytes(backend):
+    return sum(value.nbytes for value in vars(backend).values()
+               if isinstance(value, np.ndarray))
+
+
+def _microseconds(seconds):
+    return int(round(1e6 * seconds))
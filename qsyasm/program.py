@@ -1,72 +1,135 @@
+import contextlib
+import itertools
+import os
+import sys
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 
 import numpy as np
 
-from qsy import __version__, gates
-from qsy.backends import CHPBackend, StatevectorBackend
+import qsy.backends
+from qsy import __version__
 from qsy.error import InvalidRegisterError, RegisterIndexError
-from qsy.util import format_complex
+from qsy.util import format_basis_states, format_complex_array, format_dirac_terms
 
-from .env import Env
+from .compiler import QsyASMCompiler
+from .env import Env, StateBuffers
 from .error import ParseError, QsyASMError
-from .instruction import Operation
+from .histogram import Histogram
+from .instruction import OPERATION_GATES, Operation
 from .interpreter.parser import QsyASMParser
 from .log import print_info, print_warning
+from .output import write_results
 
-OPERATION_GATES = {
-    Operation.I: gates.I,
-    Operation.X: gates.X,
-    Operation.Y: gates.Y,
-    Operation.Z: gates.Z,
-
-    Operation.H: gates.H,
-    Operation.S: gates.S,
-    Operation.CX: gates.CX,
-    Operation.CY: gates.CY,
-    Operation.CZ: gates.CZ,
-
-    Operation.T: gates.T,
-    Operation.RX: gates.Rx,
-    Operation.RY: gates.Ry,
-    Operation.RZ: gates.Rz,
-    Operation.CRX: gates.CRx,
-    Operation.CRY: gates.CRy,
-    Operation.CRZ: gates.CRz,
-    Operation.CCX: gates.CCX
+# Defaults of the command-line arguments, so programs can be created from
+# Python with only the arguments that differ
+DEFAULT_ARGS = {
+    'time': False,
+    'verbose': False,
+    'backend': None,
+    'precision': 'complex128',
+    'threads': 1,
+    'state_dir': None,
+    'shots': 1,
+    'jobs': 1,
+    'seed': None,
+    'sweep': None,
+    'no_fusion': False,
+    'no_checkpoint': False,
+    'dump_state': None,
+    'output': None,
+    'dump_format': 'npy',
+    'stream': False,
+    'ignore_print_warning': False,
+    'skip_zero_amplitudes': False
+}
+
+
+# Back-end class of every --backend name. Registers refer to back-ends by name
+# and classes are looked up when a register is created, so unused back-ends
+# are never imported.
+BACKENDS = {
+    'chp': 'CHPBackend',
+    'statevector': 'StatevectorBackend',
+    'sparse': 'SparseBackend',
+    'memmap': 'MemmapBackend'
 }
 
 
 class QsyASMProgram:
     MAX_PRINTABLE_QUBITS = 16
 
-    def __init__(self, args):
+    def __init__(self, args, source=None, parser=None, buffers=None, profiler=None):
+        '''
+        Create a program from the file in args['filename'], or from source.
+        A parser and pool of state buffers can be shared between programs, and
+        a Profiler collects where the time of the program goes.
+        '''
+        args = dict(DEFAULT_ARGS, **args)
+
+        self.args = args
         self.filename = args['filename']
+        # Streamed programs are read while they're executed
+        self.stream = args['stream']
 
-        try:
-            with open(self.filename) as f:
-                self.input = f.read()
-        except Exception as e:
-            raise QsyASMError('Error reading input: {}'.format(str(e)))
+        if source is None and not self.stream:
+            try:
+                with open(self.filename) as f:
+                    source = f.read()
+            except Exception as e:
+                raise QsyASMError('Error reading input: {}'.format(str(e)))
+
+        self.input = source
 
         self.time = args['time']
         self.verbose = args['verbose']
         self.ignore_print_warning = args['ignore_print_warning']
         self.skip_zero_amplitudes = args['skip_zero_amplitudes']
 
+        self.fusion = not args['no_fusion']
+        self.checkpoint = not args['no_checkpoint']
+        self.precision = args['precision']
+        self.state_dir = args['state_dir']
+        self.threads = args['threads']
+
         self.shots = args['shots']
+        self.jobs = max(1, min(args['jobs'], self.shots))
+        self.seed = args['seed']
         self.measurement_results = {}
+        # Values of symbolic parameters, and the (name, start, stop, steps)
+        # sweeps to run
+        self.bindings = {}
+        self.sweeps = args['sweep']
+        # Sum and count of the expectation values of every (register, Pauli
+        # string) over all shots
+        self.expectation_results = {}
 
-        self.backend_arg = args['backend']
-        if self.backend_arg == 'chp':
-            self.backend = CHPBackend
-        else:
-            self.backend = StatevectorBackend
+        if self.stream and (self.shots > 1 or self.sweeps):
+            raise QsyASMError('A streamed program can only run a single shot and no sweeps')
+
+        if self.state_dir is not None and (self.shots > 1 or self.sweeps):
+            # Every shot would continue from the state the previous one left
+            raise QsyASMError('A state directory can only be used with a single shot and no sweeps')
+
+        if self.state_dir is not None:
+            try:
+                os.makedirs(self.state_dir, exist_ok=True)
+            except Exception as e:
+                raise QsyASMError('Error creating state directory: {}'.format(str(e)))
+
+        # Back-end name, or None to select one per register in run()
+        self.backend = args['backend']
 
-        self._verbose_print('Using {} backend'.format(self.backend.__name__))
+        # Back-end name of every quantum register by name
+        self.backends = {}
 
-        self.parser = QsyASMParser()
+        if self.backend is not None:
+            self._verbose_print('Using {} backend'.format(BACKENDS[self.backend]))
+
+        self.parser = parser if parser is not None else QsyASMParser()
+        self.buffers = buffers if buffers is not None else StateBuffers()
         self.env = Env()
+        self.profiler = profiler
 
     def run(self):
         print_info('qsyasm v{}'.format(__version__))
@@ -75,51 +138,259 @@ class QsyASMProgram:
 
         start = time.time()
 
+        rows = self.execute()
+        end = time.time()
+
+        with self._phase('dump'):
+            if self.args['output'] is not None:
+                output_format, path = self.args['output']
+                write_results(self, output_format, path, end - start)
+            elif self.sweeps:
+                self._print_table(rows)
+            else:
+                self.dump_registers()
+
+            if self.args['dump_state'] is not None:
+                self.save_states(self.args['dump_state'], self.args['dump_format'])
+
+        if self.time:
+            print_info('Program execution took {:.5f} seconds'.format(end - start))
+
+    def execute(self):
+        '''
+        Execute the program without printing anything. When sweeping
+        parameters, returns the rows of the sweep.
+        '''
+        if self.stream:
+            with self._phase('execute'):
+                self._run_streamed()
+            return
+
+        instructions = self._prepare()
+
+        if self.sweeps:
+            return self.sweep(self._sweep_points(instructions))
+
+        with self._phase('lower'):
+            steps = self._lower(instructions)
+
+        with self._phase('execute'):
+            self._run_program(instructions, steps)
+
+    def record(self, rows=None):
+        '''
+        Return the results of an executed program as a JSON serializable
+        record: classical register results, expectation values and printable
+        quantum states, or the sweep rows.
+        '''
+        if rows is not None:
+            return {'sweep': rows}
+
+        results = self._results({})
+
+        return {
+            'classical': {cr_name: results.pop(cr_name) for cr_name in self.env.crs},
+            'expectations': dict(results),
+            'quantum': {qr_name: qr.to_dirac() for qr_name, qr in self.env.qrs.items()
+                        if qr.size <= self.MAX_PRINTABLE_QUBITS or self.ignore_print_warning}
+        }
+
+    def release_buffers(self):
+        '''
+        Return the state buffers of all statevector registers to the pool. The
+        registers can't be used afterwards.
+        '''
+        for qr_name, qr in self.env.qrs.items():
+            if self.backends.get(qr_name) == 'statevector':
+                self.buffers.release(qr.backend.state)
+
+        self.env = Env()
+
+    def sweep(self, points):
+        '''
+        Run the program for every point, a dict of values for its symbolic
+        parameters. The program is parsed, compiled and lowered once; per
+        point only the matrices of parametric gates are rebuilt. Returns a row
+        per point with the parameter values, the classical register results
+        and the expectation values.
+        '''
+        points = [dict(point) for point in points]
+
+        if not points:
+            return []
+
+        instructions = self._prepare()
+
+        self.bindings = points[0]
+
+        with self._phase('lower'):
+            steps = self._lower(instructions)
+
+        rows = []
+        for point in points:
+            self._bind(steps, point)
+
+            self.measurement_results = {cr_name: Histogram(histogram.size)
+                                        for cr_name, histogram in self.measurement_results.items()}
+            self.expectation_results = {key: [0.0, 0] for key in self.expectation_results}
+
+            with self._phase('execute'):
+                self._run_program(instructions, steps)
+
+            rows.append(self._results(point))
+
+        return rows
+
+    def eval(self, instructions):
+        self._execute(self._lower(instructions))
+
+    def _prepare(self):
+        '''
+        Parse and compile the program, once.
+        '''
+        if hasattr(self, 'instructions'):
+            return self.instructions
+
         try:
-            instructions = self.parser.parse(self.input)
+            with self._phase('parse'):
+                instructions = self.parser.parse(self.input)
         except ParseError as e:
             raise QsyASMError(self._error_message(e.msg, e.lexpos, e.lineno))
 
-        # TODO: we can auto-detect stabilizer circuits and use the CHP back-end
-        # when it is capable of printing its state so no features are lost.
-        #  if self._can_use_chp(instructions) and self.backend_arg is None:
-        #      print_info('Stabilizer circuit detected, using CHP back-end')
-        #      self.backend = CHPBackend
+        self._select_backends(instructions)
 
-        self._verbose_print('Executing {} shots'.format(self.shots))
+        if self.fusion:
+            with self._phase('compile'):
+                instructions = self._compile(instructions)
 
-        for _ in range(self.shots):
-            self.eval(instructions)
-            self._save_measurements()
+        if self.seed is not None:
+            np.random.seed(self.seed)
 
-        end = time.time()
+        self.instructions = instructions
+        return instructions
 
-        self.dump_registers()
+    def _run_streamed(self):
+        '''
+        Parse, compile, lower and execute the program line by line, so memory
+        use doesn't grow with the program size. Without a back-end argument
+        all registers use the statevector back-end, as the gates applied to
+        a register aren't known in advance.
+        '''
+        if self.seed is not None:
+            np.random.seed(self.seed)
 
-        if self.time:
-            print_info('Program execution took {:.5f} seconds'.format(end - start))
+        if self.input is not None:
+            self._execute_lines(self.input.splitlines(True))
+            return
+
+        try:
+            f = open(self.filename)
+        except Exception as e:
+            raise QsyASMError('Error reading input: {}'.format(str(e)))
+
+        with f:
+            self._execute_lines(f)
+
+    def _execute_lines(self, lines):
+        compiler = QsyASMCompiler()
+        instructions = self._stream_backends(self.parser.parse_lines(lines), compiler)
+
+        if self.fusion:
+            instructions = compiler.stream(instructions)
+
+        try:
+            self._execute(self._lower_stream(instructions))
+        except ParseError as e:
+            raise QsyASMError(self._error_message(e.msg, e.lexpos, e.lineno))
+
+    def _stream_backends(self, instructions, compiler):
+        '''
+        Select the back-end of every quantum register as it's defined.
+        '''
+        backend = self.backend if self.backend is not None else 'statevector'
 
-    def eval(self, instructions):
         for instr in instructions:
-            try:
-                if instr.is_gate():
-                    self._eval_gate(instr)
-                elif instr.type == Operation.QR or instr.type == Operation.CR:
-                    self._eval_register(instr)
-                elif instr.type == Operation.MEASURE:
-                    self._eval_measure(instr)
-                elif instr.type == Operation.ERROR:
-                    raise QsyASMError(
-                        self._error_message(
-                            'Undefined operation "{}"'.format(instr.op[0]),
-                            instr.lexpos,
-                            instr.lineno
-                        )
-                    )
-            except (RegisterIndexError, InvalidRegisterError) as e:
-                raise QsyASMError(self._error_message(e, instr.lexpos, instr.lineno))
+            if instr.type == Operation.QR:
+                for register_name in instr.args:
+                    self.backends[register_name] = backend
+
+                    if backend == 'chp':
+                        compiler.cancel_only.add(register_name)
+
+            yield instr
+
+    def _run_program(self, instructions, steps):
+        self._verbose_print('Executing {} shots'.format(self.shots))
+
+        if self.shots > 1 and self._has_terminal_measurements(instructions):
+            self._verbose_print('Only terminal measurements, sampling shots from final state')
+            self._run_sampled(steps)
+        elif self.jobs > 1:
+            self._verbose_print('Running shots in {} processes'.format(self.jobs))
+            self._run_parallel(instructions, steps)
+        else:
+            self._run_shots(steps, self.shots)
+
+    def _sweep_points(self, instructions):
+        '''
+        Return the points of the cartesian product of all sweeps.
+        '''
+        parameters = set().union(*(instr.parameters() for instr in instructions))
+        names = []
+        values = []
+
+        for name, sweep_start, sweep_stop, steps in self.sweeps:
+            if name not in parameters:
+                print_warning('Sweep parameter "{}" is not used in the program'.format(name))
+
+            names.append(name)
+            values.append(np.linspace(sweep_start, sweep_stop, steps))
+
+        return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+    def _results(self, point):
+        '''
+        Return the parameter values, classical register results and
+        expectation values of the last run as a row.
+        '''
+        row = OrderedDict(point)
+
+        for cr_name, cr in self.env.crs.items():
+            if self.shots > 1 and cr_name in self.measurement_results:
+                row[cr_name] = self.measurement_results[cr_name].to_dict()
+            else:
+                row[cr_name] = cr.to_bits()
+
+        for (qr_name, pauli), (total, count) in self.expectation_results.items():
+            row['{}<{}>'.format(qr_name, pauli)] = total / count
+
+        return row
+
+    def _print_table(self, rows):
+        if not rows:
+            return
+
+        columns = list(rows[0].keys())
+        cells = [columns] + [
+            ['{:.5f}'.format(value) if isinstance(value, float) else str(value)
+             for value in row.values()]
+            for row in rows
+        ]
+        widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+
+        for line in cells:
+            print('  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip())
+
+    def dump_registers(self, output=None):
+        '''
+        Write the state of every quantum register and the value of every
+        classical register to output, stdout by default. States are formatted
+        and written a chunk of amplitudes at a time, so no string of a whole
+        state is built.
+        '''
+        if output is None:
+            output = sys.stdout
 
-    def dump_registers(self):
         for qr_name, qr in self.env.qrs.items():
             if qr.size > self.MAX_PRINTABLE_QUBITS and not self.ignore_print_warning:
                 print_warning(
@@ -129,42 +400,272 @@ class QsyASMProgram:
                     '--ignore-print-warning as argument)')
                 continue
 
-            print('{}[{}]: {}'.format(qr_name, qr.size, qr.to_dirac()))
+            chunks = qr.yield_chunks()
+            first = next(chunks, None)
 
-            for i, amplitude in qr.yield_state():
-                if np.isclose(amplitude, 0) and self.skip_zero_amplitudes:
-                    continue
+            output.write('{}[{}]: '.format(qr_name, qr.size))
+
+            if first is None:
+                # The back-end can't enumerate its state
+                output.write('\n')
+                continue
+
+            separator = ''
+
+            for indices, amplitudes in itertools.chain([first], chunks):
+                terms = format_dirac_terms(indices, amplitudes, qr.size)
+
+                if terms:
+                    output.write(separator + ' '.join(terms))
+                    separator = ' '
 
-                amplitude = format_complex(amplitude)
-                print('{:>8} |{:0{size}b}>'.format(amplitude, i, size=qr.size))
+            output.write('\n')
+
+            for indices, amplitudes in qr.yield_chunks():
+                if self.skip_zero_amplitudes:
+                    nonzero = ~np.isclose(amplitudes, 0)
+                    indices, amplitudes = indices[nonzero], amplitudes[nonzero]
+
+                lines = np.char.add(np.char.rjust(format_complex_array(amplitudes), 8), ' |')
+                lines = np.char.add(lines, format_basis_states(indices, qr.size))
+                output.write(''.join(line + '>\n' for line in lines.tolist()))
 
         for cr_name, cr in self.env.crs.items():
             if self.shots > 1 and self.measurement_results:
-                bits = dict(self.measurement_results[cr_name])
+                bits = self.measurement_results[cr_name].to_dict()
+            else:
+                bits = cr.to_bits()
+
+            output.write('{}[{}]: {}\n'.format(cr_name, cr.size, bits))
+
+        for (qr_name, pauli), (total, count) in self.expectation_results.items():
+            output.write('{}<{}>: {:.5f}\n'.format(qr_name, pauli, total / count))
+
+    def save_states(self, directory, output_format='npy'):
+        '''
+        Write the state of every quantum register to a file in directory:
+        <register>.npy in NumPy format, or <register>.raw with the bare
+        amplitudes. Dense states are copied to the file a chunk at a time.
+        Sparse registers are written as (index, amplitude) records of their
+        nonzero amplitudes.
+        '''
+        try:
+            os.makedirs(directory, exist_ok=True)
+
+            for qr_name, qr in self.env.qrs.items():
+                backend = self.backends[qr_name]
+
+                if backend == 'chp':
+                    print_warning('Can\'t write the state of {}, the CHP back-end has no '
+                                  'state vector'.format(qr_name))
+                    continue
+
+                path = os.path.join(directory, '{}.{}'.format(qr_name, output_format))
+                self._save_state(qr, backend == 'sparse', path, output_format)
+        except OSError as e:
+            raise QsyASMError('Error writing state: {}'.format(str(e)))
+
+    def _save_state(self, qr, sparse, path, output_format):
+        dtype = qr.backend.dtype
+        length = len(qr.backend.indices) if sparse else 2**qr.size
+
+        if sparse:
+            dtype = np.dtype([('index', np.int64), ('amplitude', dtype)])
+
+        if output_format == 'npy':
+            f = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(length,))
+        else:
+            f = np.memmap(path, mode='w+', dtype=dtype, shape=(length,))
+
+        start = 0
+        for indices, amplitudes in qr.yield_chunks():
+            end = start + len(amplitudes)
+
+            if sparse:
+                f['index'][start:end] = indices
+                f['amplitude'][start:end] = amplitudes
             else:
-                bits = ''.join(str(bit) for bit in cr.state)
+                f[start:end] = amplitudes
+
+            start = end
+
+        f.flush()
+        del f
 
-            print('{}[{}]: {}'.format(cr_name, cr.size, bits))
+    def _lower(self, instructions):
+        '''
+        Lower instructions into a list of (step, args, instruction) tuples that
+        can be executed every shot. Register names are resolved to slots in
+        self.registers, gate matrices are built and arguments are validated
+        once, so executing a shot does no name lookups or matrix construction.
+        '''
+        qregs = {}
+        cregs = {}
+        steps = []
+        # Index of every step that applies a gate with symbolic parameters
+        self.parametric_steps = []
+
+        for instr in instructions:
+            if instr.parameters():
+                self.parametric_steps.append(len(steps))
+
+            steps.append(self._lower_instruction(instr, qregs, cregs))
+
+        self.registers = [None] * (len(qregs) + len(cregs))
 
-    def _eval_gate(self, instr):
-        gate = OPERATION_GATES[instr.type]
+        return steps
+
+    def _lower_stream(self, instructions):
+        '''
+        Lower instructions one at a time, yielding every step as soon as it's
+        lowered. Slots are added to self.registers as registers are defined.
+        '''
+        qregs = {}
+        cregs = {}
+        self.registers = []
+
+        for instr in instructions:
+            step = self._lower_instruction(instr, qregs, cregs)
+
+            missing = len(qregs) + len(cregs) - len(self.registers)
+            self.registers += [None] * missing
+
+            yield step
+
+    def _lower_instruction(self, instr, qregs, cregs):
+        try:
+            if instr.is_gate():
+                step = self._lower_gate(instr, qregs)
+            elif instr.type == Operation.QR or instr.type == Operation.CR:
+                step = self._lower_register(instr, qregs, cregs)
+            elif instr.type == Operation.MEASURE:
+                step = self._lower_measure(instr, qregs, cregs)
+            elif instr.type == Operation.EXPECT:
+                step = self._lower_expect(instr, qregs)
+            elif instr.type == Operation.ERROR:
+                raise QsyASMError(
+                    self._error_message(
+                        'Undefined operation "{}"'.format(instr.op[0]),
+                        instr.lexpos,
+                        instr.lineno
+                    )
+                )
+        except (RegisterIndexError, InvalidRegisterError) as e:
+            raise QsyASMError(self._error_message(e, instr.lexpos, instr.lineno))
+
+        return step + (instr,)
+
+    def _bind(self, steps, bindings):
+        '''
+        Bind values to the symbolic parameters, rebuilding only the steps of
+        parametric gates.
+        '''
+        self.bindings = bindings
+
+        for i in self.parametric_steps:
+            step, args, instr = steps[i]
+            slot, _, targets, adjoint, message = args
+
+            gate = self._cast_gate(self._build_gate(instr), self.backends[instr.args[0][0]])
+            steps[i] = (step, (slot, gate, targets, adjoint, message), instr)
+
+    def _execute(self, steps):
+        if self.profiler is not None:
+            self._execute_profiled(steps)
+            return
+
+        for step, args, instr in steps:
+            try:
+                step(*args)
+            except (RegisterIndexError, InvalidRegisterError) as e:
+                raise QsyASMError(self._error_message(e, instr.lexpos, instr.lineno))
+
+    def _execute_profiled(self, steps):
+        '''
+        Execute steps like _execute, timing every step and recording the
+        state memory of the register it acted on.
+        '''
+        for step, args, instr in steps:
+            start = time.perf_counter()
+
+            try:
+                step(*args)
+            except (RegisterIndexError, InvalidRegisterError) as e:
+                raise QsyASMError(self._error_message(e, instr.lexpos, instr.lineno))
+
+            seconds = time.perf_counter() - start
+
+            register = instr.args[0]
+            if isinstance(register, tuple):
+                register, _ = register
+
+            self.profiler.step(register, instr.op_name, seconds)
+
+            if register in self.env.qrs:
+                self.profiler.state(register, self.backends[register],
+                                    self.env.qrs[register].backend)
+
+    def _phase(self, name):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+
+        return self.profiler.phase(name)
+
+    def _build_gate(self, instr):
+        unbound = instr.parameters() - self.bindings.keys()
+
+        if unbound:
+            raise QsyASMError(
+                self._error_message(
+                    'Undefined variable "{}"'.format(min(unbound)),
+                    instr.lexpos, instr.lineno
+                )
+            )
+
+        try:
+            return instr.get_gate(self.bindings)
+        except ZeroDivisionError:
+            raise QsyASMError(self._error_message('Division by zero', instr.lexpos,
+                                                  instr.lineno))
+
+    def _lower_gate(self, instr, qregs):
+        gate = self._build_gate(instr)
         args = instr.args
 
+        if not all(isinstance(arg, tuple) for arg in args):
+            raise QsyASMError(
+                self._error_message(
+                    'Expected qubit arguments for gate {}'.format(gate.name),
+                    instr.lexpos, instr.lineno
+                )
+            )
+
+        if len(args) != gate.arity:
+            raise QsyASMError(
+                self._error_message(
+                    'Gate {} expects {} parameters, got {}'.format(
+                        gate.name, gate.arity, len(args)
+                    ),
+                    instr.lexpos, instr.lineno
+                )
+            )
+
         # TODO: multi qubit gates across registers
         register = args[0][0]
         targets = [arg[1] for arg in args]
 
-        if callable(gate):
-            gate_arg = instr.op[1]
-            gate = gate(gate_arg)
+        slot, _ = self._lookup_register(qregs, register, 'quantum')
+        gate = self._cast_gate(gate, self.backends[register])
 
-        adjoint_message = 'adjoint ' if instr.adjoint else ''
-        self._verbose_print('Applying gate {}{} on {}{}'.format(
-                            adjoint_message, gate.name, register, targets))
+        message = None
+        if self.verbose:
+            adjoint_message = 'adjoint ' if instr.adjoint else ''
+            message = 'Applying gate {}{} on {}{}'.format(
+                adjoint_message, gate.name, register, targets)
 
-        self.env.qr(register).apply_gate(gate, *targets, adjoint=instr.adjoint)
+        return self._exec_gate, (slot, gate, targets, instr.adjoint, message)
 
-    def _eval_register(self, instr):
+    def _lower_register(self, instr, qregs, cregs):
         if len(instr.op) != 2:
             raise QsyASMError(
                 self._error_message(
@@ -174,19 +675,186 @@ class QsyASMProgram:
             )
 
         register_size = instr.op[1]
+        registers = qregs if instr.type == Operation.QR else cregs
+        slots = []
+
+        for register_name in instr.args:
+            if register_name in registers:
+                # Redefining a register replaces it
+                slot, _ = registers[register_name]
+            else:
+                slot = len(qregs) + len(cregs)
+
+            registers[register_name] = (slot, register_size)
+            slots.append((slot, register_name))
+
+            if instr.type == Operation.CR and register_name in self.measurement_results:
+                # Outcomes are saved from the last definition of the register
+                self.measurement_results[register_name].resize(register_size)
 
         if instr.type == Operation.QR:
-            for register_name in instr.args:
-                self.env.create_qr(register_name, register_size, self.backend)
-        elif instr.type == Operation.CR:
-            for register_name in instr.args:
-                self.env.create_cr(register_name, register_size)
+            return self._exec_qreg, (slots, register_size)
+        else:
+            return self._exec_creg, (slots, register_size)
+
+    def _lower_measure(self, instr, qregs, cregs):
+        qtarget_name, qubit, ctarget_name, bit = self._measure_targets(instr, qregs, cregs)
+
+        qslot, _ = self._lookup_register(qregs, qtarget_name, 'quantum')
+        cslot = None
+
+        if ctarget_name is not None:
+            cslot, csize = self._lookup_register(cregs, ctarget_name, 'classical')
+
+            # Save measurement results when shots > 1
+            if self.shots > 1 and ctarget_name not in self.measurement_results:
+                self.measurement_results[ctarget_name] = Histogram(csize)
 
-    def _eval_measure(self, instr):
+        return self._exec_measure, (qslot, qubit, cslot, bit)
+
+    def _lower_expect(self, instr, qregs):
+        if len(instr.args) != 2 or not all(isinstance(arg, str) for arg in instr.args):
+            raise QsyASMError(
+                self._error_message(
+                    'Expected a quantum register and Pauli string for expect',
+                    instr.lexpos, instr.lineno
+                )
+            )
+
+        register, pauli = instr.args
+        pauli = pauli.upper()
+        slot, size = self._lookup_register(qregs, register, 'quantum')
+
+        if len(pauli) != size or any(p not in 'IXYZ' for p in pauli):
+            raise QsyASMError(
+                self._error_message(
+                    'Invalid Pauli string "{}" for {}[{}]'.format(pauli, register, size),
+                    instr.lexpos, instr.lineno
+                )
+            )
+
+        key = (register, pauli)
+        if key not in self.expectation_results:
+            self.expectation_results[key] = [0.0, 0]
+
+        return self._exec_expect, (slot, pauli, key)
+
+    def _backend_options(self, backend, register_name):
+        if backend == 'chp':
+            return {}
+
+        options = {'precision': self.precision}
+
+        if backend == 'statevector':
+            options['threads'] = self.threads
+
+        if backend == 'memmap' and self.state_dir is not None:
+            # Existing state files are resumed
+            options['path'] = os.path.join(self.state_dir, register_name + '.state')
+
+        return options
+
+    def _cast_gate(self, gate, backend):
+        '''
+        Cast gate matrices once to the precision of the back-end state, so they
+        aren't converted every time the gate is applied.
+        '''
+        if backend == 'chp':
+            # CHP identifies gates by value, keep them untouched
+            return gate
+
+        return gate._replace(matrix=np.asarray(gate.matrix, dtype=self.precision),
+                             adjoint_matrix=np.asarray(gate.adjoint_matrix,
+                                                       dtype=self.precision))
+
+    def _lookup_register(self, registers, name, kind):
+        if name not in registers:
+            raise RegisterIndexError('Undefined {} register "{}"'.format(kind, name))
+
+        return registers[name]
+
+    def _exec_gate(self, slot, gate, targets, adjoint, message):
+        if message is not None:
+            print_info(message)
+
+        self.registers[slot].backend.apply_gate(gate, *targets, adjoint=adjoint)
+
+    def _exec_qreg(self, slots, size):
+        for slot, register_name in slots:
+            backend = self.backends[register_name]
+            previous = self.env.qrs.get(register_name)
+
+            if previous is not None and previous.size == size and self.state_dir is None:
+                # Defined in a previous shot, reset it in place instead of
+                # allocating a new state
+                previous.reset()
+                self.registers[slot] = previous
+                continue
+
+            options = self._backend_options(backend, register_name)
+
+            if backend == 'statevector':
+                # The register is replaced, so its state buffer can be reused
+                if previous is not None:
+                    self.buffers.release(previous.backend.state)
+
+                options['state'] = self.buffers.take(size, self.precision)
+
+            self.registers[slot] = self.env.create_qr(register_name, size,
+                                                      self._backend_class(backend),
+                                                      **options)
+
+    def _backend_class(self, backend):
+        return getattr(qsy.backends, BACKENDS[backend])
+
+    def _exec_creg(self, slots, size):
+        for slot, register_name in slots:
+            previous = self.env.crs.get(register_name)
+
+            if previous is not None and previous.size == size:
+                previous.reset()
+                self.registers[slot] = previous
+            else:
+                self.registers[slot] = self.env.create_cr(register_name, size)
+
+    def _exec_measure(self, qslot, qubit, cslot, bit):
+        qr = self.registers[qslot]
+
+        if qubit is None:
+            # Measure all
+            measured = qr.measure_all()
+        else:
+            # Measure single qubit
+            measured = qr.measure(qubit)
+
+        if cslot is not None:
+            # Save measurement to classical register
+            if bit is None:
+                self.registers[cslot].set_state(measured)
+            else:
+                self.registers[cslot][bit] = measured
+
+    def _exec_expect(self, slot, pauli, key):
+        value = self.registers[slot].expectation(pauli)
+
+        result = self.expectation_results[key]
+        result[0] += value
+        result[1] += 1
+
+    def _measure_targets(self, instr, qregs, cregs):
+        '''
+        Resolve the arguments of a measurement into the quantum register name,
+        qubit, classical register name and bit. The qubit and bit are None when
+        measuring a whole register, and the classical register name is None
+        when the measurement result is discarded.
+        '''
         qtarget = instr.args[0]
-        qtarget_name = qtarget[0]
+        ctarget = instr.args[1] if len(instr.args) == 2 else None
 
-        if len(instr.args) == 2 and len(instr.args[0]) != len(instr.args[1]):
+        qtarget_name, qubit = qtarget if isinstance(qtarget, tuple) else (qtarget, None)
+        ctarget_name, bit = ctarget if isinstance(ctarget, tuple) else (ctarget, None)
+
+        if ctarget is not None and (qubit is None) != (bit is None):
             raise QsyASMError(
                 self._error_message(
                     'Mismatched register sizes in measurement',
@@ -195,60 +863,238 @@ class QsyASMProgram:
                 )
             )
 
-        if len(qtarget) == 1:
-            # Measure all
-            measured = self.env.qr(qtarget_name).measure_all()
-        elif len(qtarget) == 2:
-            # Measure single qubit
-            qubit = qtarget[1]
-            measured = self.env.qr(qtarget_name).measure(qubit)
+        if ctarget is not None and qubit is None:
+            # Ensure the classical and quantum registers are of the same size
+            # when measuring all qubits
+            _, qtarget_size = self._lookup_register(qregs, qtarget_name, 'quantum')
+            _, ctarget_size = self._lookup_register(cregs, ctarget_name, 'classical')
 
-        if len(instr.args) == 2:
-            # Save measurement to classical register
-            ctarget = instr.args[1]
-
-            if len(ctarget) == 1:
-                if len(qtarget) == 1:
-                    # Ensure the classical and quantum registers are of the same size
-                    # when measuring all qubits
-                    qtarget_size = self.env.qr(qtarget).size
-                    ctarget_size = self.env.cr(ctarget).size
-
-                    if qtarget_size != ctarget_size:
-                        raise QsyASMError(
-                            self._error_message(
-                                'Mismatched register sizes in measurement ({}[{}] and {}[{}])'.format(
-                                    qtarget_name, qtarget_size, ctarget[0], ctarget_size
-                                ),
-                                instr.lexpos,
-                                instr.lineno
-                            )
-                        )
-
-                self.env.cr(ctarget).set_state(measured)
-            elif len(ctarget) == 2:
-                ctarget, register_index = ctarget
-                self.env.cr(ctarget)[register_index] = measured
+            if qtarget_size != ctarget_size:
+                raise QsyASMError(
+                    self._error_message(
+                        'Mismatched register sizes in measurement ({}[{}] and {}[{}])'.format(
+                            qtarget_name, qtarget_size, ctarget_name, ctarget_size
+                        ),
+                        instr.lexpos,
+                        instr.lineno
+                    )
+                )
 
-            # Save measurement results when shots > 1
-            if self.shots > 1 and ctarget not in self.measurement_results:
-                self.measurement_results[ctarget] = defaultdict(int)
+        return qtarget_name, qubit, ctarget_name, bit
+
+    def _compile(self, instructions):
+        # The CHP back-end only supports Clifford gates, so gates can't be
+        # fused into arbitrary unitaries there
+        chp_registers = {name for name, backend in self.backends.items()
+                         if backend == 'chp'}
+        compiler = QsyASMCompiler(cancel_only=chp_registers)
+        compiled = compiler.compile(instructions)
+
+        gate_count = sum(1 for instr in instructions if instr.is_gate())
+        compiled_gate_count = sum(1 for instr in compiled if instr.is_gate())
+        self._verbose_print('Gate fusion removed {} of {} gates'.format(
+                            gate_count - compiled_gate_count, gate_count))
+
+        return compiled
+
+    def _run_shots(self, steps, shots):
+        split = self._checkpoint_split(steps) if shots > 1 and self.checkpoint else 0
+
+        if split > 0:
+            self._verbose_print('Restarting shots from the state after {} steps'.format(split))
+
+            # The steps before the first measurement do the same every shot,
+            # so they're executed once and every shot restores their state
+            self._execute(steps[:split])
+            steps = steps[split:]
+
+            snapshots = [(qr, qr.snapshot()) for qr in self.env.qrs.values()]
+
+        for shot in range(shots):
+            if split > 0 and shot > 0:
+                for qr, snapshot in snapshots:
+                    qr.restore(snapshot)
+
+                for cr in self.env.crs.values():
+                    cr.reset()
+
+            self._execute(steps)
+            self._save_measurements()
+
+    def _checkpoint_split(self, steps):
+        '''
+        Return the amount of steps at the start of a program that give the
+        same state every shot: register definitions and gates up to the first
+        measurement or expectation value. Returns 0 when there are no gates to
+        skip, or when registers are defined later on, as those would replace
+        the registers the shots are restarted from.
+        '''
+        split = next((i for i, (_, _, instr) in enumerate(steps)
+                      if not (instr.is_gate() or instr.type in (Operation.QR, Operation.CR))),
+                     len(steps))
+
+        if any(instr.type in (Operation.QR, Operation.CR) for _, _, instr in steps[split:]):
+            return 0
+
+        if not any(instr.is_gate() for _, _, instr in steps[:split]):
+            return 0
+
+        return split
+
+    def _run_parallel(self, instructions, steps):
+        '''
+        Split the shots over a pool of worker processes, each with its own
+        environment and an independent random stream derived from the seed.
+        The first chunk runs in this process so its registers can be dumped.
+        '''
+        chunks = [self.shots // self.jobs + (i < self.shots % self.jobs)
+                  for i in range(self.jobs)]
+        seeds = np.random.SeedSequence(self.seed).spawn(self.jobs)
+
+        # Only imported when shots run in parallel, it's slow to import
+        import multiprocessing
+
+        with multiprocessing.Pool(self.jobs - 1) as pool:
+            results = [
+                pool.apply_async(_run_worker,
+                                 (self.args, self.input, instructions, self.backends,
+                                  self.bindings, shots, seed))
+                for shots, seed in zip(chunks[1:], seeds[1:])
+            ]
+
+            np.random.seed(seeds[0].generate_state(4))
+            self._run_shots(steps, chunks[0])
+
+            for result in results:
+                measurement_results, expectation_results = result.get()
+                self._merge_measurements(measurement_results)
+
+                for key, (total, count) in expectation_results.items():
+                    self.expectation_results[key][0] += total
+                    self.expectation_results[key][1] += count
+
+    def _merge_measurements(self, measurement_results):
+        for cr_name, histogram in measurement_results.items():
+            if cr_name not in self.measurement_results:
+                self.measurement_results[cr_name] = Histogram(histogram.size)
+
+            self.measurement_results[cr_name].merge(histogram)
+
+    def _has_terminal_measurements(self, instructions):
+        '''
+        Determine if all measurements happen at the end of a program, so shots
+        can be sampled from the final state instead of re-executing the program.
+        '''
+        measured = False
+
+        for instr in instructions:
+            if instr.type == Operation.MEASURE:
+                measured = True
+            elif measured:
+                return False
+
+        # Outcomes of CHP registers don't fit in integer basis state indices
+        return all(backend != 'chp' for backend in self.backends.values())
+
+    def _run_sampled(self, steps):
+        '''
+        Simulate the unitary part of a program once and draw the outcomes of
+        all but the last shot from the final state at once. The last shot is
+        measured normally so registers are left as after a regular run.
+        '''
+        split = next((i for i, (_, _, instr) in enumerate(steps)
+                      if instr.type == Operation.MEASURE), len(steps))
+        unitary, measurements = steps[:split], steps[split:]
+
+        self._execute(unitary)
+
+        shots = self.shots - 1
+        samples = {}
+        # Outcome of every shot per classical register, packed into an
+        # integer with the first bit the most significant. Registers wider
+        # than 64 bits use Python integers.
+        outcomes = {cr_name: np.zeros(shots, dtype=np.uint64 if cr.size <= 64 else object)
+                    for cr_name, cr in self.env.crs.items()}
+
+        for _, args, instr in measurements:
+            try:
+                self._sample_measure(*args, shots, samples, outcomes)
+            except (RegisterIndexError, InvalidRegisterError) as e:
+                raise QsyASMError(self._error_message(e, instr.lexpos, instr.lineno))
+
+        for cr_name, histogram in self.measurement_results.items():
+            histogram.add_outcomes(outcomes[cr_name])
+
+        self._execute(measurements)
+        self._save_measurements()
+
+    def _sample_measure(self, qslot, qubit, cslot, bit, shots, samples, outcomes):
+        if cslot is None:
+            return
+
+        qr = self.registers[qslot]
+        cr = self.registers[cslot]
+
+        # Sample each quantum register once so outcomes stay correlated
+        if qslot not in samples:
+            samples[qslot] = qr.backend.sample(shots)
+
+        sampled = samples[qslot]
+        codes = outcomes[cr.name]
+
+        if qubit is None:
+            # Registers of a measurement of all qubits have the same size
+            codes[:] = sampled.astype(codes.dtype)
+        else:
+            qr.backend._check_in_range(qubit)
+
+            values = (sampled >> (qr.size - 1 - qubit)) & 1
+            _set_bit(codes, cr.size - 1 - bit, values)
 
     def _save_measurements(self):
-        for cr_name in self.measurement_results.keys():
-            cr_value = self.env.cr(cr_name).state
-            bit_string = ''.join(str(bit) for bit in cr_value)
-            self.measurement_results[cr_name][bit_string] += 1
+        with self._phase('save_measurements'):
+            for cr_name, histogram in self.measurement_results.items():
+                histogram.add(self.env.crs[cr_name].value)
 
-    def _can_use_chp(self, instructions):
+    def _select_backends(self, instructions):
         '''
-        Determine if a program is a stabilizer circuit and can use the CHP
-        back-end.
+        Select the back-end of every quantum register. Without a back-end
+        argument, registers that only have Clifford gates applied and are too
+        large to print their state use the CHP back-end, and all other
+        registers use the statevector back-end.
         '''
+        sizes = defaultdict(int)
+
         for instr in instructions:
-            if instr.is_gate():
+            if instr.type == Operation.QR and len(instr.op) == 2:
+                for register_name in instr.args:
+                    sizes[register_name] = max(sizes[register_name], instr.op[1])
+
+        for register_name, size in sizes.items():
+            if self.backend is not None:
+                backend = self.backend
+            elif size > self.MAX_PRINTABLE_QUBITS and \
+                    self._can_use_chp(instructions, register_name):
+                backend = 'chp'
+            else:
+                backend = 'statevector'
+
+            self.backends[register_name] = backend
+
+            if self.backend is None:
+                self._verbose_print('Using {} for register {}'.format(
+                                    BACKENDS[backend], register_name))
+
+    def _can_use_chp(self, instructions, register_name):
+        '''
+        Determine if the gates applied to a register form a stabilizer circuit
+        and it can use the CHP back-end.
+        '''
+        for instr in instructions:
+            if instr.is_gate() and instr.args and isinstance(instr.args[0], tuple) \
+                    and instr.args[0][0] == register_name:
                 gate = OPERATION_GATES[instr.type]
-                if gate not in CHPBackend.SUPPORTED_GATES:
+                if gate not in self._backend_class('chp').SUPPORTED_GATES:
                     return False
 
         return True
@@ -262,5 +1108,37 @@ class QsyASMProgram:
         return '{}:{}:{}: {}'.format(self.filename, lineno, column, msg)
 
     def _find_column(self, lexpos):
+        if self.stream:
+            # Streamed instructions are positioned relative to their line
+            return lexpos + 1
+
         line_start = self.input.rfind('\n', 0, lexpos) + 1
         return (lexpos - line_start) + 1
+
+
+def _set_bit(codes, position, values):
+    '''
+    Set the bit at position, counted from the least significant bit, of
+    every code in place to the matching value of 0 or 1.
+    '''
+    one = codes.dtype.type(1)
+    position = codes.dtype.type(position)
+
+    codes &= ~(one << position)
+    codes |= values.astype(codes.dtype) << position
+
+
+def _run_worker(args, source, instructions, backends, bindings, shots, seed):
+    '''
+    Run a chunk of shots in a worker process and return its histograms and
+    expectation value sums. The source is passed along, as a program from a
+    batch may have no file to read it from.
+    '''
+    np.random.seed(seed.generate_state(4))
+
+    program = QsyASMProgram(args, source=source)
+    program.backends = backends
+    program.bindings = bindings
+    program._run_shots(program._lower(instructions), shots)
+
+    return program.measurement_results, program.expectation_results
@@ -19,7 +19,7 @@ setup(
     long_description_content_type='text/markdown',
     url='https://github.com/soudy/qsy',
     license='MIT',
-    install_requires=['numpy>=1.13', 'ply>=3'],
+    install_requires=['numpy>=1.17', 'ply>=3'],
     download_url='https://github.com/soudy/qsy/archive/v{}.tar.gz'.format(version),
     keywords=['quantum', 'computing', 'simulator', 'stabilizer', 'circuit',
               'assembly', 'chp', 'statevector'],
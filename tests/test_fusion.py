@@ -0,0 +1,63 @@
+import tracemalloc
+
+import numpy as np
+
+from qsy import gates
+from qsy.backends import StatevectorBackend
+from qsyasm.compiler import QsyASMCompiler
+from qsyasm.interpreter.parser import QsyASMParser
+
+SOURCE = '''qreg[18] q
+h q[2]
+cx q[2], q[11]
+rz(pi/3) q[11]
+h q[11]
+'''
+
+
+def compile_source(source):
+    return QsyASMCompiler().compile(QsyASMParser().parse(source))
+
+
+def test_gates_are_fused_into_one_block():
+    compiled = [instr for instr in compile_source(SOURCE) if instr.is_gate()]
+
+    assert len(compiled) == 1
+    assert compiled[0].op_name == 'u'
+
+
+def test_fused_block_matches_gates():
+    fused, = [instr for instr in compile_source(SOURCE) if instr.is_gate()]
+
+    expected = StatevectorBackend(18, 'q')
+    expected.apply_gate(gates.H, 2)
+    expected.apply_gate(gates.CX, 2, 11)
+    expected.apply_gate(gates.Rz(np.pi/3), 11)
+    expected.apply_gate(gates.H, 11)
+
+    backend = StatevectorBackend(18, 'q')
+    backend.apply_gate(fused.get_gate(), *[qubit for _, qubit in fused.args])
+
+    assert np.allclose(backend.state, expected.state)
+
+
+def test_fused_block_memory_is_bounded_by_block_size():
+    fused, = [instr for instr in compile_source(SOURCE) if instr.is_gate()]
+    gate = fused.get_gate()
+    targets = [qubit for _, qubit in fused.args]
+
+    backend = StatevectorBackend(18, 'q')
+    for target in range(18):
+        backend.apply_gate(gates.H, target)
+
+    tracemalloc.start()
+    try:
+        backend.apply_gate(gate, *targets)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Fusing must not cost more memory than applying the gates one by one:
+    # a few blocks of scratch space instead of copies of the 4 MiB state
+    block_bytes = StatevectorBackend.BLOCK_SIZE * backend.state.itemsize
+    assert peak <= 8 * block_bytes
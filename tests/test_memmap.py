@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from qsy import gates
+from qsy.backends import MemmapBackend, StatevectorBackend
+
+
+def prepare(backend):
+    for target in range(backend.size):
+        backend.apply_gate(gates.H, target)
+        backend.apply_gate(gates.Rz(0.3 * (target + 1)), target)
+
+    backend.apply_gate(gates.CX, 0, backend.size - 1)
+
+
+@pytest.fixture(params=[None, 'state'])
+def backend(request, tmp_path):
+    path = None if request.param is None else str(tmp_path / request.param)
+
+    # Chunks of 4 amplitudes, so every operation walks several chunks
+    return MemmapBackend(5, 'q', path=path, chunk_qubits=2)
+
+
+def test_inherited_attributes(backend):
+    assert backend.threads == 1
+    assert backend._executor is None
+
+
+def test_reset(backend):
+    prepare(backend)
+    backend.reset()
+
+    expected = np.zeros(2**5, dtype=complex)
+    expected[0] = 1
+
+    assert np.array_equal(np.asarray(backend.state), expected)
+
+
+def test_snapshot_and_restore(backend):
+    prepare(backend)
+    snapshot = backend.snapshot()
+    prepared = np.array(backend.state)
+
+    backend.measure_all()
+    assert not np.allclose(np.asarray(backend.state), prepared)
+
+    backend.restore(snapshot)
+    assert np.array_equal(np.asarray(backend.state), prepared)
+
+    # A snapshot can be restored more than once
+    backend.reset()
+    backend.restore(snapshot)
+    assert np.array_equal(np.asarray(backend.state), prepared)
+
+
+def test_matches_statevector(backend):
+    expected = StatevectorBackend(5, 'q')
+
+    prepare(backend)
+    prepare(expected)
+
+    assert np.allclose(np.asarray(backend.state), expected.state)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from qsyasm.histogram import Histogram
+from qsyasm.program import _set_bit
+
+
+@pytest.mark.parametrize('dtype, size', [(np.uint64, 8), (np.uint64, 64), (object, 70)])
+def test_set_bit(dtype, size):
+    codes = np.zeros(4, dtype=dtype)
+
+    _set_bit(codes, size - 1, np.array([1, 0, 1, 0]))
+    _set_bit(codes, 0, np.array([1, 1, 0, 0]))
+    # Setting a bit again overwrites it
+    _set_bit(codes, size - 1, np.array([0, 0, 1, 1]))
+
+    top = 1 << (size - 1)
+    assert [int(code) for code in codes] == [1, 1, top, top]
+
+
+@pytest.mark.parametrize('dtype, size', [(np.uint64, 3), (np.uint64, 64), (object, 70)])
+def test_histogram_counts_outcomes(dtype, size):
+    top = 1 << (size - 1)
+    outcomes = np.array([0, top, 1, top, top], dtype=dtype)
+
+    histogram = Histogram(size)
+    histogram.add_outcomes(outcomes)
+
+    assert histogram.items() == [(0, 1), (1, 1), (top, 3)]
@@ -0,0 +1,139 @@
+import itertools
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from qsy import gates
+from qsy.backends import StatevectorBackend
+
+
+def random_state(size, seed=0):
+    rng = np.random.default_rng(seed)
+    state = rng.normal(size=2**size) + 1j*rng.normal(size=2**size)
+    return state / np.linalg.norm(state)
+
+
+def random_unitary(qubits, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(size=(2**qubits, 2**qubits)) + 1j*rng.normal(size=(2**qubits, 2**qubits))
+    return np.linalg.qr(matrix)[0]
+
+
+def operator(matrix, targets, controls, size):
+    '''
+    Build the full 2^n x 2^n operator of a matrix on targets, applied where
+    all controls are 1, with qubit 0 the most significant bit.
+    '''
+    result = np.zeros((2**size, 2**size), dtype=complex)
+
+    for column in range(2**size):
+        bits = [(column >> (size - 1 - qubit)) & 1 for qubit in range(size)]
+
+        if not all(bits[control] for control in controls):
+            result[column, column] = 1
+            continue
+
+        source = int(''.join(str(bits[target]) for target in targets), 2)
+
+        for output in range(2**len(targets)):
+            for position, target in enumerate(targets):
+                bits[target] = (output >> (len(targets) - 1 - position)) & 1
+
+            row = int(''.join(str(bit) for bit in bits), 2)
+            result[row, column] += matrix[output][source]
+
+    return result
+
+
+def apply(backend, gate, qubits, adjoint=False):
+    state = random_state(backend.size)
+    backend.state[:] = state
+    backend.apply_gate(gate, *qubits, adjoint=adjoint)
+
+    matrix = np.asarray(gate.adjoint_matrix if adjoint else gate.matrix)
+
+    if len(matrix) == 2**len(qubits):
+        expected = operator(matrix, list(qubits), [], backend.size) @ state
+    else:
+        *controls, target = qubits
+        expected = operator(matrix, [target], controls, backend.size) @ state
+
+    return expected
+
+
+GATES = list(itertools.chain(
+    ((gates.H, (target,)) for target in range(5)),
+    ((gates.Rx(0.4), (target,)) for target in range(5)),
+    ((gates.T, (target,)) for target in range(5)),
+    ((gates.CX, qubits) for qubits in itertools.permutations(range(5), 2)),
+    ((gates.CCX, qubits) for qubits in itertools.permutations(range(5), 3)),
+    ((gates.U(random_unitary(2)), qubits) for qubits in itertools.permutations(range(5), 2)),
+    ((gates.U(random_unitary(3)), qubits) for qubits in [(0, 1, 2), (4, 0, 2), (3, 1, 4)])
+))
+
+
+@pytest.mark.parametrize('block_size', [StatevectorBackend.BLOCK_SIZE, 2])
+@pytest.mark.parametrize('adjoint', [False, True])
+def test_gates_match_operator(monkeypatch, block_size, adjoint):
+    monkeypatch.setattr(StatevectorBackend, 'BLOCK_SIZE', block_size)
+    backend = StatevectorBackend(5, 'q')
+
+    for gate, qubits in GATES:
+        expected = apply(backend, gate, qubits, adjoint)
+        assert np.allclose(backend.state, expected), (gate.name, qubits)
+
+
+def test_threaded_gates_match_operator(monkeypatch):
+    monkeypatch.setattr(StatevectorBackend, 'PARALLEL_THRESHOLD', 1)
+    monkeypatch.setattr(StatevectorBackend, 'BLOCK_SIZE', 4)
+    backend = StatevectorBackend(5, 'q', threads=3)
+
+    for gate, qubits in GATES:
+        expected = apply(backend, gate, qubits)
+        assert np.allclose(backend.state, expected), (gate.name, qubits)
+
+
+@pytest.mark.parametrize('gate, qubits', [
+    (gates.H, (0,)),
+    (gates.H, (9,)),
+    (gates.H, (17,)),
+    (gates.CX, (0, 17)),
+    (gates.CCX, (17, 3, 9)),
+    (gates.U(random_unitary(2)), (4, 12)),
+    (gates.U(random_unitary(2)), (17, 0))
+])
+def test_gate_memory_is_bounded_by_block_size(gate, qubits):
+    backend = StatevectorBackend(18, 'q')
+    backend.state[:] = random_state(18)
+
+    tracemalloc.start()
+    try:
+        backend.apply_gate(gate, *qubits)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # A few blocks of scratch space and NumPy's buffers for strided views,
+    # far less than the 4 MiB state
+    block_bytes = StatevectorBackend.BLOCK_SIZE * backend.state.itemsize
+    assert peak <= 8 * block_bytes
+
+
+@pytest.mark.parametrize('size', [1, 2, 3])
+def test_threaded_measure_on_small_registers(monkeypatch, size):
+    monkeypatch.setattr(StatevectorBackend, 'PARALLEL_THRESHOLD', 1)
+
+    for target in range(size):
+        threaded = StatevectorBackend(size, 'q', threads=4)
+        single = StatevectorBackend(size, 'q')
+
+        for backend in (threaded, single):
+            backend.state[:] = random_state(size, seed=target)
+
+        np.random.seed(target)
+        measured = threaded.measure(target)
+        np.random.seed(target)
+
+        assert measured == single.measure(target)
+        assert np.allclose(threaded.state, single.state)